@@ -4,7 +4,6 @@ from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from dotenv import load_dotenv
 import os
-import mysql.connector
 
 # Load environment variables
 load_dotenv()
@@ -14,26 +13,20 @@ jwt = JWTManager()
 
 def test_db_connection():
     """Test database connection"""
+    from app.database import get_pool
     try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST', 'localhost'),
-            user=os.getenv('DB_USER', 'root'),
-            password=os.getenv('DB_PASSWORD', ''),
-            database=os.getenv('DB_NAME', 'foodvision_db'),
-            charset='utf8mb4',
-            collation='utf8mb4_unicode_ci'
-        )
-        if connection.is_connected():
+        connection = get_pool().get_connection()
+        try:
             cursor = connection.cursor()
             cursor.execute("SELECT 1")
             cursor.fetchone()
             cursor.close()
-            connection.close()
             return True
-    except mysql.connector.Error as e:
+        finally:
+            connection.close()
+    except Exception as e:
         print(f"Database connection test failed: {e}")
         return False
-    return False
 
 def create_app(config_name='development'):
     """Application factory pattern"""
@@ -44,10 +37,23 @@ def create_app(config_name='development'):
     app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key-foodvision-2024')
     app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 16777216))
     app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'uploads')
+    app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 10))
+    app.config['DB_POOL_TIMEOUT'] = float(os.getenv('DB_POOL_TIMEOUT', 5))
+    app.config['DB_POOL_RECYCLE'] = float(os.getenv('DB_POOL_RECYCLE', 280))
+    app.config['SERVICE_WARMUP'] = os.getenv('SERVICE_WARMUP', 'false').lower() in ('1', 'true', 'yes')
+    app.config['ANALYSIS_ASYNC'] = os.getenv('ANALYSIS_ASYNC', 'false').lower() in ('1', 'true', 'yes')
+    app.config['ANALYSIS_BATCH_MAX_IMAGES'] = int(os.getenv('ANALYSIS_BATCH_MAX_IMAGES', 6))
+    app.config['ANALYSIS_EVENTS_HEARTBEAT'] = float(os.getenv('ANALYSIS_EVENTS_HEARTBEAT', 15))
+    app.config['ANALYSIS_EVENTS_TIMEOUT'] = float(os.getenv('ANALYSIS_EVENTS_TIMEOUT', 300))
+    app.config['ANALYSIS_EVENTS_TOKEN_TTL'] = float(os.getenv('ANALYSIS_EVENTS_TOKEN_TTL', 600))
     
     # Initialize JWT with app
     jwt.init_app(app)
     
+    # Shared MySQL connection pool used by every blueprint
+    from app.database import init_db_pool
+    db_pool = init_db_pool(app)
+    
     # CORS configuration - Dynamic origins based on environment
     frontend_url = os.getenv('FRONTEND_URL', 'http://localhost:3000')
     allowed_origins = [
@@ -76,6 +82,13 @@ def create_app(config_name='development'):
     upload_path = os.path.join(os.getcwd(), app.config['UPLOAD_FOLDER'])
     os.makedirs(upload_path, exist_ok=True)
     
+    # Gemini and USDA clients, created once per worker
+    try:
+        from app.services.clients import init_service_clients
+        init_service_clients(app)
+    except ImportError as e:
+        print(f"Warning: Could not initialize API clients: {e}")
+    
     # Import and register blueprints
     try:
         from app.routes.auth import auth_bp
@@ -101,27 +114,53 @@ def create_app(config_name='development'):
     @app.route('/test-db')
     def test_db():
         try:
-            # Test database connection using mysql.connector
-            connection = mysql.connector.connect(
-                host=os.getenv('DB_HOST', 'localhost'),
-                user=os.getenv('DB_USER', 'root'),
-                password=os.getenv('DB_PASSWORD', ''),
-                database=os.getenv('DB_NAME', 'foodvision_db'),
-                charset='utf8mb4',
-                collation='utf8mb4_unicode_ci'
-            )
-            if connection.is_connected():
+            connection = db_pool.get_connection()
+            try:
                 cursor = connection.cursor()
                 cursor.execute("SELECT 1 as test")
                 result = cursor.fetchone()
                 cursor.close()
+            finally:
                 connection.close()
-                return {'status': 'success', 'message': 'Database connection successful', 'result': result}
-            else:
-                return {'status': 'error', 'message': 'Database connection failed'}, 500
+            return {'status': 'success', 'message': 'Database connection successful', 'result': result}
         except Exception as e:
             return {'status': 'error', 'message': f'Database connection failed: {str(e)}'}, 500
     
+    # Runtime counters for monitoring
+    @app.route('/metrics')
+    def metrics():
+        from app.services.usda_cache import get_usda_cache
+        from app.services.negative_cache import get_usda_negative_cache
+        from app.services.ingredient_resolver import get_ingredient_resolver
+        from app.services.rate_limiter import get_usda_rate_limiter
+        from app.services.usda_offline import get_offline_food_index
+        from app.services.image_cache import get_gemini_image_cache
+        from app.services.image_preprocessing import preprocess_stats
+        from app.services.gemini_output import output_stats
+        from app.services.image_sessions import get_image_session_store
+        from app.services.circuit_breaker import get_gemini_breaker
+        from app.services.gemini_governor import get_gemini_governor
+        from app.services.analysis_jobs import get_analysis_job_runner
+        from app.services.analysis_progress import get_progress_broker
+        from app.services.reanalysis import get_reanalysis_policy
+        return {
+            'db_pool': db_pool.stats(),
+            'usda_cache': get_usda_cache().stats(),
+            'usda_negative_cache': get_usda_negative_cache().stats(),
+            'ingredient_resolver': get_ingredient_resolver().stats(),
+            'usda_rate_limiter': get_usda_rate_limiter().stats(),
+            'usda_offline': get_offline_food_index().stats(),
+            'gemini_image_cache': get_gemini_image_cache().stats(),
+            'image_preprocessing': preprocess_stats.stats(),
+            'gemini_output': output_stats.stats(),
+            'gemini_image_sessions': get_image_session_store().stats(),
+            'gemini_breaker': get_gemini_breaker().stats(),
+            'gemini_governor': get_gemini_governor().stats(),
+            'analysis_jobs': get_analysis_job_runner().stats(),
+            'analysis_progress': get_progress_broker().stats(),
+            'reanalysis': get_reanalysis_policy().stats()
+        }
+    
     # Error handlers
     @app.errorhandler(404)
     def not_found(error):
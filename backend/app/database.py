@@ -0,0 +1,339 @@
+# Shared MySQL connection pool for all blueprints
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+from flask import g, has_request_context
+import mysql.connector
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+
+class PooledConnection:
+    """
+    Thin wrapper around a MySQL connection checked out from ConnectionPool.
+
+    Behaves like the underlying connection, except that close() hands the
+    connection back to the pool instead of tearing down the TCP session.
+    """
+
+    def __init__(self, pool: 'ConnectionPool', raw_connection):
+        self._pool = pool
+        self._raw = raw_connection
+
+    def close(self):
+        """Return the connection to the pool (safe to call more than once)"""
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool._release(raw)
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise mysql.connector.errors.OperationalError("Connection already returned to pool")
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RequestConnection:
+    """
+    Per-request handle on a pooled connection stored in flask.g.
+
+    close() is a no-op so that the scattered ``conn.close()`` calls in the
+    blueprints and their helpers all share one connection (and one open
+    transaction); the connection goes back to the pool in the teardown hook.
+    """
+
+    def __init__(self, pooled: PooledConnection):
+        self._pooled = pooled
+
+    def close(self):
+        """Released by release_request_connection() at the end of the request"""
+
+    def __getattr__(self, name):
+        return getattr(self._pooled, name)
+
+
+class ConnectionPool:
+    def __init__(self, pool_size: int = 10, timeout: float = 5.0, recycle: float = 280.0, **connect_args):
+        """
+        Initialize a bounded MySQL connection pool
+
+        Connections are created lazily, validated with a ping on checkout and
+        replaced once they have been idle longer than ``recycle`` seconds.
+
+        Args:
+            pool_size: Maximum number of open connections
+            timeout: Seconds to wait for a free connection before giving up
+            recycle: Idle seconds after which a connection is reopened
+            connect_args: Keyword arguments for mysql.connector.connect
+        """
+        self.pool_size = max(int(pool_size), 1)
+        self.timeout = float(timeout)
+        self.recycle = float(recycle)
+        self.connect_args = connect_args
+
+        self._lock = threading.Condition()
+        self._idle = deque()  # (raw_connection, returned_at)
+        self._open = 0
+        self._pid = os.getpid()
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'created': 0,
+            'recycled': 0,
+            'validation_failures': 0
+        }
+
+    def get_connection(self, timeout: Optional[float] = None) -> PooledConnection:
+        """
+        Check out a validated connection from the pool
+
+        Args:
+            timeout: Override for the pool's checkout timeout in seconds
+
+        Returns:
+            PooledConnection wrapping a live MySQL connection
+        """
+        self._reset_after_fork()
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        waited = False
+
+        with self._lock:
+            raw, returned_at = None, None
+            while not self._idle and self._open >= self.pool_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeoutError(
+                        f"No database connection available after waiting {self.timeout}s "
+                        f"(pool size {self.pool_size})"
+                    )
+                if not waited:
+                    self._stats['waits'] += 1
+                    waited = True
+                self._lock.wait(remaining)
+
+            if self._idle:
+                raw, returned_at = self._idle.pop()
+            else:
+                self._open += 1  # reserve a slot, connect outside the lock
+
+        if raw is None:
+            raw = self._connect()
+        else:
+            raw = self._validate(raw, returned_at)
+
+        with self._lock:
+            self._stats['checkouts'] += 1
+        return PooledConnection(self, raw)
+
+    def _connect(self):
+        """Open a new physical connection for a slot already reserved"""
+        try:
+            raw = mysql.connector.connect(**self.connect_args)
+        except Exception:
+            self._discard(None)
+            raise
+        with self._lock:
+            self._stats['created'] += 1
+        return raw
+
+    def _validate(self, raw, returned_at: float):
+        """Return raw if usable, otherwise replace it with a fresh connection"""
+        if time.monotonic() - returned_at > self.recycle:
+            with self._lock:
+                self._stats['recycled'] += 1
+            self._close_quietly(raw)
+            return self._connect()
+
+        try:
+            raw.ping(reconnect=False)
+            return raw
+        except Exception as e:
+            logging.warning(f"Discarding stale pooled connection: {e}")
+            with self._lock:
+                self._stats['validation_failures'] += 1
+            self._close_quietly(raw)
+            return self._connect()
+
+    def _release(self, raw):
+        """Reset connection state and put it back on the idle stack"""
+        try:
+            if raw.unread_result:
+                raw.consume_results()
+            if raw.in_transaction:
+                # Never leak an open transaction (or a stale snapshot) to the next user
+                raw.rollback()
+        except Exception as e:
+            logging.warning(f"Dropping pooled connection that failed to reset: {e}")
+            self._close_quietly(raw)
+            self._discard(None)
+            return
+
+        with self._lock:
+            self._idle.append((raw, time.monotonic()))
+            self._lock.notify()
+
+    def _discard(self, raw):
+        """Free a slot whose connection is gone"""
+        if raw is not None:
+            self._close_quietly(raw)
+        with self._lock:
+            self._open = max(self._open - 1, 0)
+            self._lock.notify()
+
+    def _close_quietly(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _reset_after_fork(self):
+        """Drop connections inherited from a parent process (e.g. gunicorn --preload)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            self._idle.clear()
+            self._open = 0
+            self._pid = os.getpid()
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+            self._open -= len(idle)
+            self._lock.notify_all()
+        for raw, _ in idle:
+            self._close_quietly(raw)
+
+    def stats(self) -> Dict:
+        """Return pool counters for monitoring"""
+        with self._lock:
+            return {
+                **self._stats,
+                'pool_size': self.pool_size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._open - len(self._idle)
+            }
+
+
+_pool: Optional[ConnectionPool] = None
+_request_scoped = False
+
+
+def _connect_args() -> Dict:
+    return {
+        'host': os.getenv('DB_HOST', 'localhost'),
+        'user': os.getenv('DB_USER', 'root'),
+        'password': os.getenv('DB_PASSWORD', ''),
+        'database': os.getenv('DB_NAME', 'foodvision_db'),
+        'charset': 'utf8mb4',
+        'collation': 'utf8mb4_unicode_ci'
+    }
+
+
+def init_db_pool(app) -> ConnectionPool:
+    """Create the process-wide connection pool from app config"""
+    global _pool, _request_scoped
+
+    _pool = ConnectionPool(
+        pool_size=app.config.get('DB_POOL_SIZE', 10),
+        timeout=app.config.get('DB_POOL_TIMEOUT', 5),
+        recycle=app.config.get('DB_POOL_RECYCLE', 280),
+        **_connect_args()
+    )
+    app.extensions['db_pool'] = _pool
+    app.teardown_appcontext(release_request_connection)
+    _request_scoped = True
+    return _pool
+
+
+def get_pool() -> ConnectionPool:
+    """Return the shared pool, creating a default one outside create_app"""
+    global _pool
+
+    if _pool is None:
+        _pool = ConnectionPool(
+            pool_size=int(os.getenv('DB_POOL_SIZE', 10)),
+            timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+            recycle=float(os.getenv('DB_POOL_RECYCLE', 280)),
+            **_connect_args()
+        )
+    return _pool
+
+
+def get_request_connection() -> RequestConnection:
+    """Lazily check out the connection shared by everything in this request"""
+    if 'db_conn' not in g:
+        g.db_conn = RequestConnection(get_pool().get_connection())
+    return g.db_conn
+
+
+def release_request_connection(exception=None):
+    """Teardown hook: roll back on error and hand the connection back to the pool"""
+    conn = g.pop('db_conn', None)
+    if conn is None:
+        return
+
+    pooled = conn._pooled
+    if exception is not None:
+        try:
+            pooled.rollback()
+        except Exception as e:
+            logging.warning(f"Rollback during request teardown failed: {e}")
+    pooled.close()
+
+
+@contextmanager
+def request_transaction(dictionary: bool = True):
+    """
+    Run a block of statements as one transaction on the request connection
+
+    Commits when the block exits normally and rolls back if it raises.
+
+    Args:
+        dictionary: Whether the yielded cursor returns rows as dicts
+
+    Yields:
+        Cursor bound to the request-scoped connection
+    """
+    conn = get_request_connection()
+    cursor = conn.cursor(dictionary=dictionary)
+    try:
+        yield cursor
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def get_db_connection():
+    """
+    Get a database connection (None if the database is unreachable)
+
+    Inside a request this is the request-scoped connection, so nested helpers
+    reuse it; outside a request (scripts, background threads) it is a plain
+    pooled connection that the caller must close().
+    """
+    try:
+        if _request_scoped and has_request_context():
+            return get_request_connection()
+        return get_pool().get_connection()
+    except (mysql.connector.Error, PoolTimeoutError) as e:
+        print(f"Database connection error: {e}")
+        return None
@@ -1,26 +1,10 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-import mysql.connector
-import os
 from datetime import datetime, timedelta
 
-dashboard_bp = Blueprint('dashboard', __name__)
+from ..database import get_db_connection
 
-def get_db_connection():
-    """Get database connection"""
-    try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST', 'localhost'),
-            user=os.getenv('DB_USER', 'root'),
-            password=os.getenv('DB_PASSWORD', ''),
-            database=os.getenv('DB_NAME', 'foodvision_db'),
-            charset='utf8mb4',
-            collation='utf8mb4_unicode_ci'
-        )
-        return connection
-    except mysql.connector.Error as e:
-        print(f"Database connection error: {e}")
-        return None
+dashboard_bp = Blueprint('dashboard', __name__)
 
 @dashboard_bp.route('/overview', methods=['GET'])
 @jwt_required()
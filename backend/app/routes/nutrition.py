@@ -1,26 +1,10 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-import mysql.connector
-import os
 from datetime import datetime, timedelta
 
-nutrition_bp = Blueprint('nutrition', __name__)
+from ..database import get_db_connection
 
-def get_db_connection():
-    """Get database connection"""
-    try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST', 'localhost'),
-            user=os.getenv('DB_USER', 'root'),
-            password=os.getenv('DB_PASSWORD', ''),
-            database=os.getenv('DB_NAME', 'foodvision_db'),
-            charset='utf8mb4',
-            collation='utf8mb4_unicode_ci'
-        )
-        return connection
-    except mysql.connector.Error as e:
-        print(f"Database connection error: {e}")
-        return None
+nutrition_bp = Blueprint('nutrition', __name__)
 
 @nutrition_bp.route('/history', methods=['GET'])
 @jwt_required()
@@ -117,7 +101,7 @@ def get_daily_summary():
         
         # If no summary exists for today, create one by aggregating user's meals
         if not daily_summary:
-            daily_summary = create_daily_summary_for_date(user_id, target_date, cursor, conn)
+            daily_summary = create_daily_summary_for_date(user_id, target_date)
         
         # Get all meals for this date
         cursor.execute("""
@@ -183,9 +167,13 @@ def get_daily_summary():
         print(f"Daily summary error: {e}")
         return jsonify({'error': 'Failed to get daily summary'}), 500
 
-def create_daily_summary_for_date(user_id, target_date, cursor, conn):
+def create_daily_summary_for_date(user_id, target_date):
     """Create daily summary by aggregating nutrition data for a specific date"""
     try:
+        # Shares the request-scoped connection with the calling route
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        
         # Get all detected foods for this date
         cursor.execute("""
             SELECT SUM(df.calories) as total_calories,
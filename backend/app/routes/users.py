@@ -1,28 +1,12 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from werkzeug.security import generate_password_hash, check_password_hash
-import mysql.connector
-import os
 import json
 from datetime import datetime
 
-users_bp = Blueprint('users', __name__)
+from ..database import get_db_connection
 
-def get_db_connection():
-    """Get database connection"""
-    try:
-        connection = mysql.connector.connect(
-            host=os.getenv('DB_HOST', 'localhost'),
-            user=os.getenv('DB_USER', 'root'),
-            password=os.getenv('DB_PASSWORD', ''),
-            database=os.getenv('DB_NAME', 'foodvision_db'),
-            charset='utf8mb4',
-            collation='utf8mb4_unicode_ci'
-        )
-        return connection
-    except mysql.connector.Error as e:
-        print(f"Database connection error: {e}")
-        return None
+users_bp = Blueprint('users', __name__)
 
 @users_bp.route('/profile', methods=['GET'])
 @jwt_required()
@@ -65,7 +49,7 @@ def get_profile():
                 preferences = json.loads(preferences)
         else:
             # Create default preferences if none exist
-            preferences = create_default_preferences(user_id, cursor, conn)
+            preferences = create_default_preferences(user_id)
         
         # Get basic stats
         cursor.execute("""
@@ -96,8 +80,8 @@ def get_profile():
         print(f"Get profile error: {e}")
         return jsonify({'error': 'Failed to get profile'}), 500
 
-def create_default_preferences(user_id, cursor, conn):
-    """Create default preferences for a user"""
+def create_default_preferences(user_id):
+    """Create default preferences for a user on the request's shared connection"""
     default_prefs = {
         'units': 'metric',
         'language': 'en',
@@ -108,6 +92,8 @@ def create_default_preferences(user_id, cursor, conn):
     }
     
     try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
         cursor.execute("""
             INSERT INTO user_preferences (user_id, preferences, created_at, updated_at)
             VALUES (%s, %s, NOW(), NOW())
@@ -115,6 +101,7 @@ def create_default_preferences(user_id, cursor, conn):
                 preferences = VALUES(preferences),
                 updated_at = NOW()
         """, (user_id, json.dumps(default_prefs)))
+        cursor.close()
         
         conn.commit()
         return default_prefs
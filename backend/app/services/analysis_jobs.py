@@ -0,0 +1,140 @@
+# Background worker pool for asynchronous food analysis jobs
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from ..database import get_db_connection
+from .analysis_pipeline import run_analysis, set_session_status
+from .analysis_progress import get_progress_broker
+
+
+class AnalysisJobRunner:
+    def __init__(self, max_workers: int = 4):
+        """
+        Run the analysis pipeline off the request thread
+
+        The upload request only stores the image and a 'pending' session; a
+        job moves the session to 'processing' and then 'completed' (written by
+        the pipeline itself) or 'failed'. Clients poll GET /api/food/session/<id>.
+
+        Args:
+            max_workers: Analyses running concurrently in this process
+        """
+        self.max_workers = max(int(max_workers), 1)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='analysis-job')
+        self._lock = threading.Lock()
+
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'queued': 0,
+            'running': 0,
+            'total_seconds': 0.0
+        }
+
+    def submit(self, app, session_id: int, user_id, file_path: str, unique_filename: str, meal_type: str, notes: str):
+        """Queue a pending session for analysis"""
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._stats['queued'] += 1
+        return self._executor.submit(
+            self._run, app, session_id, user_id, file_path, unique_filename, meal_type, notes
+        )
+
+    def submit_task(self, func, *args):
+        """Run follow-up work (e.g. applying a deferred re-analysis) on the job pool"""
+        return self._executor.submit(func, *args)
+
+    def _run(self, app, session_id, user_id, file_path, unique_filename, meal_type, notes):
+        with self._lock:
+            self._stats['queued'] -= 1
+            self._stats['running'] += 1
+        started = time.perf_counter()
+        status = 500
+
+        # Settle the queued/running counters however the job ends
+        try:
+            progress = get_progress_broker().open(session_id).publish
+
+            with app.app_context():
+                _update_session_status(session_id, 'processing')
+                progress('processing')
+                try:
+                    body, status = run_analysis(
+                        user_id, file_path, unique_filename, meal_type, notes,
+                        session_id=session_id, progress=progress
+                    )
+                except Exception as e:
+                    logging.error(f"Analysis job for session {session_id} crashed: {e}")
+                    body, status = {'error': 'Food analysis failed', 'details': str(e)}, 500
+
+                if status != 200:
+                    # The pipeline rolled back its writes; record why on the session
+                    _update_session_status(session_id, 'failed', body)
+
+            if status == 200:
+                progress('completed', result=body)
+            else:
+                progress('failed', error=body.get('details') or body.get('error'))
+        except Exception as e:
+            status = 500
+            logging.error(f"Analysis job for session {session_id} failed outside the pipeline: {e}")
+        finally:
+            with self._lock:
+                self._stats['running'] -= 1
+                self._stats['completed' if status == 200 else 'failed'] += 1
+                self._stats['total_seconds'] += time.perf_counter() - started
+
+        logging.info(f"Analysis job for session {session_id} finished with status {status}")
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            finished = self._stats['completed'] + self._stats['failed']
+            return {
+                **self._stats,
+                'total_seconds': round(self._stats['total_seconds'], 3),
+                'avg_seconds': round(self._stats['total_seconds'] / finished, 3) if finished else 0.0,
+                'max_workers': self.max_workers
+            }
+
+
+def _update_session_status(session_id: int, status: str, details: Optional[Dict] = None):
+    conn = get_db_connection()
+    if not conn:
+        logging.error(f"Could not mark session {session_id} as {status}: database unavailable")
+        return
+
+    cursor = conn.cursor()
+    try:
+        set_session_status(cursor, session_id, status, details)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Could not mark session {session_id} as {status}: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+
+_runner: Optional[AnalysisJobRunner] = None
+_runner_pid = None
+_runner_lock = threading.Lock()
+
+
+def get_analysis_job_runner() -> AnalysisJobRunner:
+    """Return this worker's job pool (recreated after fork), sized by ANALYSIS_WORKERS"""
+    global _runner, _runner_pid
+
+    if _runner is None or _runner_pid != os.getpid():
+        with _runner_lock:
+            if _runner is None or _runner_pid != os.getpid():
+                _runner = AnalysisJobRunner(max_workers=int(os.getenv('ANALYSIS_WORKERS', 4)))
+                _runner_pid = os.getpid()
+    return _runner
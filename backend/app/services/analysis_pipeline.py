@@ -0,0 +1,914 @@
+# Food analysis pipeline: Gemini analysis, USDA enrichment and persistence
+import json
+import time
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from ..database import get_db_connection
+from .async_runtime import run_async
+from .clients import get_gemini_service, get_usda_service
+from .reanalysis import SpeculativeLookups, get_reanalysis_policy, pipeline_reanalysis_enabled
+
+
+def analyze_image(file_path: str, on_ingredient=None) -> Dict:
+    """Run Gemini analysis on the worker's long-lived event loop"""
+    return run_async(get_gemini_service().analyze_food_image(file_path, on_ingredient=on_ingredient))
+
+
+def resolve_confidence(analysis_result: Dict) -> float:
+    """Pick the confidence reported to the user for a Gemini result"""
+    # FIX 1: Extract and preserve actual confidence from Gemini
+    main_food = analysis_result.get('main_food', {})
+    
+    # Use actual Gemini confidence - DON'T OVERRIDE
+    actual_confidence = analysis_result.get('confidence_overall', 0.8)
+    if main_food.get('confidence'):
+        # Use main food confidence as it's usually more accurate
+        actual_confidence = main_food.get('confidence')
+    
+    print(f"✅ FIX 1: Using actual Gemini confidence: {actual_confidence}")
+    return actual_confidence
+
+
+def sum_nutrition(nutrition_values) -> Dict:
+    """Add up nutrition dictionaries key by key"""
+    total_nutrition = {'calories': 0, 'protein': 0, 'carbs': 0, 'fat': 0, 'fiber': 0, 'sugar': 0, 'sodium': 0}
+    for nutrition in nutrition_values:
+        for key in total_nutrition:
+            total_nutrition[key] += nutrition.get(key, 0)
+    return total_nutrition
+
+
+def enrich_ingredient(ingredient: Dict, usda_data: Optional[Dict], usda_service) -> Dict:
+    """
+    Attach per-portion nutrition to one ingredient detected by Gemini
+    
+    Args:
+        ingredient: Ingredient from the Gemini result
+        usda_data: USDA search result for its name (None falls back to estimates)
+        usda_service: USDA client used for the fallback estimate
+        
+    Returns:
+        Enriched ingredient with nutrition and data_source
+    """
+    ingredient_name = ingredient.get('name', 'Unknown')
+    ingredient_category = ingredient.get('category', 'General')
+    
+    print(f"   Processing: {ingredient_name} - Category: {ingredient_category}")
+    
+    # Calculate portion in grams
+    raw_portion = ingredient.get('estimated_portion', 100)
+    try:
+        portion_grams = float(raw_portion) if not isinstance(raw_portion, str) else 100
+    except (ValueError, TypeError):
+        portion_grams = 100
+    
+    # Calculate nutrition for this portion
+    ingredient_nutrition = {'calories': 0, 'protein': 0, 'carbs': 0, 'fat': 0, 'fiber': 0, 'sugar': 0, 'sodium': 0}
+    data_source = 'none'
+    
+    if usda_data and usda_data.get('nutrition'):
+        # Use USDA data
+        nutrition_per_100g = usda_data['nutrition']
+        portion_multiplier = portion_grams / 100.0
+    
+        ingredient_nutrition = {
+            'calories': round(nutrition_per_100g.get('calories', 0) * portion_multiplier, 1),
+            'protein': round(nutrition_per_100g.get('protein', 0) * portion_multiplier, 1),
+            'carbs': round(nutrition_per_100g.get('carbs', 0) * portion_multiplier, 1),
+            'fat': round(nutrition_per_100g.get('fat', 0) * portion_multiplier, 1),
+            'fiber': round(nutrition_per_100g.get('fiber', 0) * portion_multiplier, 1),
+            'sugar': round(nutrition_per_100g.get('sugar', 0) * portion_multiplier, 1),
+            'sodium': round(nutrition_per_100g.get('sodium', 0) * portion_multiplier, 1)
+        }
+        data_source = 'usda'
+        print(f"     ✅ USDA: {ingredient_nutrition['calories']} cal")
+    else:
+        # Use fallback estimates
+        fallback_data = usda_service.get_fallback_nutrition_estimate(ingredient_name, ingredient_category)
+        if fallback_data and fallback_data.get('nutrition'):
+            nutrition_per_100g = fallback_data['nutrition']
+            portion_multiplier = portion_grams / 100.0
+    
+            ingredient_nutrition = {
+                'calories': round(nutrition_per_100g.get('calories', 0) * portion_multiplier, 1),
+                'protein': round(nutrition_per_100g.get('protein', 0) * portion_multiplier, 1),
+                'carbs': round(nutrition_per_100g.get('carbs', 0) * portion_multiplier, 1),
+                'fat': round(nutrition_per_100g.get('fat', 0) * portion_multiplier, 1),
+                'fiber': round(nutrition_per_100g.get('fiber', 0) * portion_multiplier, 1),
+                'sugar': round(nutrition_per_100g.get('sugar', 0) * portion_multiplier, 1),
+                'sodium': round(nutrition_per_100g.get('sodium', 0) * portion_multiplier, 1)
+            }
+            data_source = 'fallback'
+            print(f"     ⚠️  Fallback: {ingredient_nutrition['calories']} cal")
+    
+    # Create enriched ingredient with preserved category
+    enriched_ingredient = {
+        'name': ingredient_name,
+        'category': ingredient_category,  # FIX: Preserve original category
+        'estimated_portion': portion_grams,
+        'portion_unit': ingredient.get('portion_unit', 'grams'),
+        'confidence': ingredient.get('confidence', 0.8),
+        'nutrition': ingredient_nutrition,
+        'data_source': data_source,
+        'usda_data': usda_data if usda_data else None
+    }
+    return enriched_ingredient
+
+
+def enrich_ingredients(ingredients: List[Dict], usda_service=None, progress=None,
+                       prefetched: Optional[Dict] = None) -> Tuple[List[Dict], Dict]:
+    """
+    Attach per-portion nutrition to every ingredient detected by Gemini
+    
+    Args:
+        ingredients: Ingredient list from the Gemini result
+        usda_service: USDA client (defaults to the worker's shared client)
+        progress: Optional progress(stage, **data) callback; receives an
+            'ingredient_enriched' event as each USDA lookup completes
+        prefetched: USDA lookups already started (during streaming or re-analysis), by name
+        
+    Returns:
+        Tuple of (enriched ingredients, total nutrition)
+    """
+    usda_service = usda_service or get_usda_service()
+    
+    # FIX 2: Proper nutrition enrichment for each ingredient
+    enriched_ingredients = [None] * len(ingredients)
+    
+    print(f"🔍 Processing {len(ingredients)} ingredients:")
+    
+    positions = {}
+    for index, ingredient in enumerate(ingredients):
+        positions.setdefault(ingredient.get('name', 'Unknown'), []).append(index)
+    
+    def on_result(name, usda_data):
+        for index in positions[name]:
+            enriched_ingredients[index] = enrich_ingredient(ingredients[index], usda_data, usda_service)
+            if progress:
+                progress('ingredient_enriched', index=index, ingredient=enriched_ingredients[index])
+    
+    # Fan the USDA lookups out in parallel; each ingredient is enriched as its lookup lands
+    usda_service.search_foods_concurrently(list(positions), on_result=on_result, pending=prefetched)
+    
+    total_nutrition = sum_nutrition(enriched['nutrition'] for enriched in enriched_ingredients)
+    
+    print(f"✅ FIX 2: Total nutrition calculated: {total_nutrition['calories']} cal")
+    return enriched_ingredients, total_nutrition
+
+
+def create_pending_session(cursor, user_id, file_path: str, unique_filename: str) -> int:
+    """Insert a 'pending' analysis session for an image awaiting processing"""
+    cursor.execute("""
+        INSERT INTO food_analysis_sessions (user_id, image_path, image_filename, analysis_status, created_at)
+        VALUES (%s, %s, %s, %s, %s)
+    """, (user_id, file_path, unique_filename, 'pending', datetime.now()))
+    return cursor.lastrowid
+
+
+def set_session_status(cursor, session_id: int, status: str, details: Optional[Dict] = None):
+    """Move a session to another analysis_status, optionally storing details as raw JSON"""
+    if details is not None:
+        cursor.execute("""
+            UPDATE food_analysis_sessions
+            SET analysis_status = %s, gemini_analysis_raw = %s, updated_at = %s
+            WHERE id = %s
+        """, (status, json.dumps(details), datetime.now(), session_id))
+    else:
+        cursor.execute("""
+            UPDATE food_analysis_sessions
+            SET analysis_status = %s, updated_at = %s
+            WHERE id = %s
+        """, (status, datetime.now(), session_id))
+
+
+def add_to_daily_summary(cursor, user_id, day, total_nutrition: Dict, meal_count: int = 1):
+    """
+    Add analysed nutrition to the user's daily_nutrition_summary row
+    
+    Args:
+        day: Summary date
+        total_nutrition: Nutrition to add
+        meal_count: Number of analysis sessions the nutrition covers
+    """
+    cursor.execute("""
+        SELECT id, total_calories, total_protein, total_carbs, total_fat, 
+               total_fiber, total_sugar, total_sodium, meal_count
+        FROM daily_nutrition_summary 
+        WHERE user_id = %s AND date = %s
+    """, (user_id, day))
+    existing_summary = cursor.fetchone()
+    
+    if existing_summary:
+        # Update existing entry
+        cursor.execute("""
+            UPDATE daily_nutrition_summary 
+            SET total_calories = total_calories + %s,
+                total_protein = total_protein + %s,
+                total_carbs = total_carbs + %s,
+                total_fat = total_fat + %s,
+                total_fiber = total_fiber + %s,
+                total_sugar = total_sugar + %s,
+                total_sodium = total_sodium + %s,
+                meal_count = meal_count + %s,
+                updated_at = %s
+            WHERE user_id = %s AND date = %s
+        """, (
+            Decimal(str(total_nutrition.get('calories', 0))),
+            Decimal(str(total_nutrition.get('protein', 0))),
+            Decimal(str(total_nutrition.get('carbs', 0))),
+            Decimal(str(total_nutrition.get('fat', 0))),
+            Decimal(str(total_nutrition.get('fiber', 0))),
+            Decimal(str(total_nutrition.get('sugar', 0))),
+            Decimal(str(total_nutrition.get('sodium', 0))),
+            meal_count,
+            datetime.now(),
+            user_id, day
+        ))
+        print(f"✅ FIX 7: Updated daily nutrition summary")
+    else:
+        # Create new entry
+        cursor.execute("""
+            INSERT INTO daily_nutrition_summary 
+            (user_id, date, total_calories, total_protein, total_carbs, total_fat,
+             total_fiber, total_sugar, total_sodium, meal_count, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, (
+            user_id, day,
+            Decimal(str(total_nutrition.get('calories', 0))),
+            Decimal(str(total_nutrition.get('protein', 0))),
+            Decimal(str(total_nutrition.get('carbs', 0))),
+            Decimal(str(total_nutrition.get('fat', 0))),
+            Decimal(str(total_nutrition.get('fiber', 0))),
+            Decimal(str(total_nutrition.get('sugar', 0))),
+            Decimal(str(total_nutrition.get('sodium', 0))),
+            meal_count,
+            datetime.now(), datetime.now()
+        ))
+        print(f"✅ FIX 7: Created daily nutrition summary")
+
+
+def insert_detected_ingredients(cursor, session_id: int, main_food_id, enriched_ingredients: List[Dict]) -> List[Dict]:
+    """
+    Write a session's enriched ingredients to detected_ingredients in one round trip
+    
+    Returns:
+        detected_foods entries for the API response, with their new ids
+    """
+    # FIX 5: CORRECTED - Save ingredients ONLY to detected_ingredients (NOT to foods table)
+    # Ingredients should reference the main food_id, not create individual food entries
+    detected_foods_response = []
+    
+    # FIX: All ingredients reference the MAIN FOOD ID, not individual food entries
+    # This eliminates redundancy - ingredients are NOT foods, they are components of the main food
+    detected_ingredient_query = """
+    INSERT INTO detected_ingredients (
+        session_id, food_id, ingredient_name, ingredient_category, estimated_portion, portion_unit, 
+        estimated_weight_grams, confidence_score, calories, protein, 
+        carbs, fat, fiber, sugar, sodium, created_at
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """
+    
+    created_at = datetime.now()
+    ingredient_rows = []
+    for ingredient in enriched_ingredients:
+        nutrition = ingredient.get('nutrition', {})
+        ingredient_rows.append((
+            session_id,
+            main_food_id,  # FIX: ALL ingredients reference the main food, not individual entries
+            ingredient.get('name'),
+            ingredient.get('category'),  # Preserve original category from Gemini
+            Decimal(str(ingredient.get('estimated_portion', 100))),
+            ingredient.get('portion_unit', 'grams'),
+            Decimal(str(ingredient.get('estimated_portion', 100))),  # estimated_weight_grams
+            Decimal(str(ingredient.get('confidence', 0.8))),
+            Decimal(str(nutrition.get('calories', 0))),
+            Decimal(str(nutrition.get('protein', 0))),
+            Decimal(str(nutrition.get('carbs', 0))),
+            Decimal(str(nutrition.get('fat', 0))),
+            Decimal(str(nutrition.get('fiber', 0))),
+            Decimal(str(nutrition.get('sugar', 0))),
+            Decimal(str(nutrition.get('sodium', 0))),
+            created_at
+        ))
+    
+    if ingredient_rows:
+        # executemany() rewrites this into one multi-row INSERT: a single round trip
+        # per session, and lastrowid is the id of the first inserted row
+        cursor.executemany(detected_ingredient_query, ingredient_rows)
+        first_ingredient_id = cursor.lastrowid
+        id_step = _auto_increment_step(cursor)
+    
+    for index, ingredient in enumerate(enriched_ingredients):
+        detected_foods_response.append({
+            'id': first_ingredient_id + index * id_step,
+            'food_id': main_food_id,  # FIX: Reference main food ID
+            'name': ingredient.get('name'),
+            'category': ingredient.get('category'),
+            'portion': ingredient.get('estimated_portion'),
+            'unit': ingredient.get('portion_unit', 'grams'),
+            'confidence': ingredient.get('confidence'),
+            'nutrition': ingredient.get('nutrition', {}),
+            'data_source': ingredient.get('data_source')
+        })
+    
+    return detected_foods_response
+
+
+def persist_analysis(cursor, user_id, file_path: str, unique_filename: str, analysis_result: Dict,
+                     enriched_ingredients: List[Dict], total_nutrition: Dict, actual_confidence: float,
+                     meal_type: str, notes: str, session_id: Optional[int] = None,
+                     update_daily_summary: bool = True) -> Dict:
+    """
+    Write a finished analysis: session, main food, ingredients, preferences,
+    daily summary and user meal. The caller owns the transaction.
+    
+    Args:
+        session_id: Existing (pending/processing) session to complete; a new
+            session row is inserted when omitted
+        update_daily_summary: False when the caller adds several sessions to
+            the daily summary in one statement (batch analysis)
+        
+    Returns:
+        Dictionary with session_id, user_meal_id, main_food_id, detected_foods and meal_date
+    """
+    main_food = analysis_result.get('main_food', {})
+    
+    if session_id is None:
+        # Create analysis session with ACTUAL confidence and nutrition
+        session_query = """
+        INSERT INTO food_analysis_sessions (user_id, image_path, image_filename, analysis_status, 
+                                          gemini_analysis_raw, total_estimated_calories, confidence_score, created_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """
+        
+        cursor.execute(session_query, (
+            user_id, 
+            file_path, 
+            unique_filename, 
+            'completed',
+            json.dumps(analysis_result),  # Store complete Gemini result
+            Decimal(str(total_nutrition.get('calories', 0))),
+            Decimal(str(actual_confidence)),  # Use actual confidence
+            datetime.now()
+        ))
+        session_id = cursor.lastrowid
+    else:
+        # Complete the session created when the job was queued
+        cursor.execute("""
+            UPDATE food_analysis_sessions
+            SET analysis_status = %s, gemini_analysis_raw = %s, total_estimated_calories = %s,
+                confidence_score = %s, updated_at = %s
+            WHERE id = %s
+        """, (
+            'completed',
+            json.dumps(analysis_result),
+            Decimal(str(total_nutrition.get('calories', 0))),
+            Decimal(str(actual_confidence)),
+            datetime.now(),
+            session_id
+        ))
+    
+    print(f"✅ FIX 3a: Session {session_id} saved with confidence {actual_confidence}")
+    
+    # FIX 4: Save main food to foods table
+    main_food_id = None
+    if main_food.get('name'):
+        print(f"🔍 Saving main food: {main_food.get('name')}")
+    
+        # Check if main food already exists
+        cursor.execute("SELECT id FROM foods WHERE name = %s", (main_food.get('name'),))
+        existing_main_food = cursor.fetchone()
+    
+        if existing_main_food:
+            main_food_id = existing_main_food['id']
+            print(f"     ✅ Found existing main food with ID: {main_food_id}")
+        else:
+            # Create new main food entry
+            main_food_query = """
+            INSERT INTO foods (name, description, category_id, serving_size, serving_unit,
+                             calories_per_100g, protein_per_100g, carbs_per_100g, fat_per_100g,
+                             fiber_per_100g, sugar_per_100g, sodium_per_100g, gemini_source, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """
+    
+            # Calculate per-100g nutrition from total
+            main_dish_portion = main_food.get('estimated_portion', 300)
+            per_100g_multiplier = 100.0 / main_dish_portion
+    
+            cursor.execute(main_food_query, (
+                main_food.get('name'),
+                main_food.get('description', ''),
+                None,  # category_id will be determined later
+                main_dish_portion,
+                main_food.get('portion_unit', 'grams'),
+                Decimal(str(round(total_nutrition.get('calories', 0) * per_100g_multiplier, 2))),
+                Decimal(str(round(total_nutrition.get('protein', 0) * per_100g_multiplier, 2))),
+                Decimal(str(round(total_nutrition.get('carbs', 0) * per_100g_multiplier, 2))),
+                Decimal(str(round(total_nutrition.get('fat', 0) * per_100g_multiplier, 2))),
+                Decimal(str(round(total_nutrition.get('fiber', 0) * per_100g_multiplier, 2))),
+                Decimal(str(round(total_nutrition.get('sugar', 0) * per_100g_multiplier, 2))),
+                Decimal(str(round(total_nutrition.get('sodium', 0) * per_100g_multiplier, 2))),
+                True,  # gemini_source
+                datetime.now(),
+                datetime.now()
+            ))
+            main_food_id = cursor.lastrowid
+            print(f"     ✅ Created new main food with ID: {main_food_id}")
+    
+    detected_foods_response = insert_detected_ingredients(cursor, session_id, main_food_id, enriched_ingredients)
+    print(f"✅ FIX 5: Saved {len(detected_foods_response)} ingredients referencing main food ID {main_food_id}")
+    
+    # FIX 6: Update user preferences with detected foods
+    try:
+        cursor.execute("SELECT id, preferences FROM user_preferences WHERE user_id = %s", (user_id,))
+        existing_prefs = cursor.fetchone()
+    
+        # Extract favorite foods from analysis (high confidence foods)
+        favorite_foods = [food['name'] for food in detected_foods_response if food.get('confidence', 0) > 0.8]
+    
+        if existing_prefs:
+            # Update existing preferences
+            try:
+                current_prefs = json.loads(existing_prefs['preferences']) if isinstance(existing_prefs['preferences'], str) else existing_prefs['preferences']
+            except:
+                current_prefs = {}
+    
+            # Ensure structure exists
+            if 'diet' not in current_prefs:
+                current_prefs['diet'] = {}
+            if 'favorite_foods' not in current_prefs['diet']:
+                current_prefs['diet']['favorite_foods'] = []
+    
+            # Add new favorite foods
+            for food in favorite_foods:
+                if food not in current_prefs['diet']['favorite_foods']:
+                    current_prefs['diet']['favorite_foods'].append(food)
+    
+            # Update timestamp
+            current_prefs['last_updated'] = datetime.now().isoformat()
+    
+            cursor.execute("""
+                UPDATE user_preferences 
+                SET preferences = %s, updated_at = %s
+                WHERE user_id = %s
+            """, (json.dumps(current_prefs), datetime.now(), user_id))
+    
+            print(f"✅ FIX 6: Updated user preferences with {len(favorite_foods)} favorite foods")
+        else:
+            # Create default preferences
+            default_prefs = {
+                "diet": {
+                    "favorite_foods": favorite_foods,
+                    "dietary_restrictions": [],
+                    "preferred_meal_times": {
+                        "breakfast": "07:00",
+                        "lunch": "12:00", 
+                        "dinner": "19:00"
+                    }
+                },
+                "goals": {
+                    "daily_calories": 2000,
+                    "weekly_weight": 0,
+                    "macronutrient_distribution": {
+                        "protein_percentage": 15,
+                        "carbs_percentage": 50,
+                        "fat_percentage": 35
+                    }
+                },
+                "display": {
+                    "nutrition_order": ["calories", "protein", "carbs", "fat", "fiber"],
+                    "hide_detailed_nutrition": False
+                },
+                "general": {
+                    "language": "en",
+                    "units": "metric"
+                },
+                "notifications": {
+                    "enabled": True,
+                    "daily_reminder_time": "09:00"
+                },
+                "last_updated": datetime.now().isoformat()
+            }
+    
+            cursor.execute("""
+                INSERT INTO user_preferences (user_id, preferences, created_at, updated_at)
+                VALUES (%s, %s, %s, %s)
+            """, (user_id, json.dumps(default_prefs), datetime.now(), datetime.now()))
+    
+            print(f"✅ FIX 6: Created user preferences with {len(favorite_foods)} favorite foods")
+    
+    except Exception as pref_error:
+        logging.warning(f"Failed to update user preferences: {pref_error}")
+        # Don't fail the whole operation for preferences
+    
+    # FIX 7: Update or create daily nutrition summary
+    today = datetime.now().date()
+    if update_daily_summary:
+        add_to_daily_summary(cursor, user_id, today, total_nutrition)
+    
+    # FIX 8: Save to user_meals table - MISSING from previous code
+    # Get meal_type_id based on meal_type string
+    cursor.execute("SELECT id FROM meal_types WHERE name = %s", (meal_type.capitalize(),))
+    meal_type_record = cursor.fetchone()
+    meal_type_id = meal_type_record['id'] if meal_type_record else 2  # Default to lunch if not found
+    
+    # Insert into user_meals
+    user_meal_query = """
+    INSERT INTO user_meals (user_id, session_id, meal_type_id, meal_date, meal_time, notes, created_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """
+    
+    cursor.execute(user_meal_query, (
+        user_id,
+        session_id,
+        meal_type_id,
+        today,
+        datetime.now(),
+        notes,
+        datetime.now()
+    ))
+    user_meal_id = cursor.lastrowid
+    
+    print(f"✅ FIX 8: Saved to user_meals table with ID {user_meal_id}")
+    
+    print(f"🎉 ALL FIXES APPLIED SUCCESSFULLY!")
+    print(f"   Session ID: {session_id}")
+    print(f"   User Meal ID: {user_meal_id}")
+    print(f"   Confidence: {actual_confidence}")
+    print(f"   Main Food ID: {main_food_id} ('{main_food.get('name')}')")
+    print(f"   Ingredients: {len(detected_foods_response)} (all referencing main food)")
+    print(f"   Total Nutrition: {total_nutrition}")
+    
+    return {
+        'session_id': session_id,
+        'user_meal_id': user_meal_id,
+        'main_food_id': main_food_id,
+        'detected_foods': detected_foods_response,
+        'meal_date': today
+    }
+
+
+def build_analysis_response(persisted: Dict, analysis_result: Dict, total_nutrition: Dict,
+                            actual_confidence: float, meal_type: str) -> Dict:
+    """Shape the JSON body returned to the client for a completed analysis"""
+    main_food = analysis_result.get('main_food', {})
+    session_id = persisted['session_id']
+    user_meal_id = persisted['user_meal_id']
+    main_food_id = persisted['main_food_id']
+    detected_foods_response = persisted['detected_foods']
+    today = persisted['meal_date']
+    
+    # Return complete response with corrected structure
+    return {
+        'success': True,
+        'session_id': session_id,
+        'user_meal_id': user_meal_id,
+        'analysis_result': {
+            'session_id': session_id,
+            'status': 'completed',
+            'detected_foods': detected_foods_response,
+            'main_food': {
+                'id': main_food_id,
+                'name': main_food.get('name'),
+                'description': main_food.get('description'),
+                'confidence': actual_confidence
+            },
+            'total_nutrition': total_nutrition,
+            'confidence': actual_confidence,  # Use actual confidence
+            'image_quality': analysis_result.get('image_quality', 'good'),
+            'additional_notes': analysis_result.get('additional_notes', ''),
+            'meal_type': meal_type,
+            'meal_date': today.isoformat(),
+            'analysis_time': datetime.now().isoformat(),
+            'database_structure_fixes': [
+                'main_food_only_in_foods_table',
+                'ingredients_reference_main_food_id', 
+                'no_redundant_ingredient_foods',
+                'user_meals_table_integration',
+                'proper_database_relationships'
+            ],
+            'fixes_applied': [
+                'confidence_preservation',
+                'nutrition_calculation', 
+                'main_food_saving',
+                'ingredient_categories',
+                'user_preferences_update',
+                'daily_summary_update',
+                'user_meals_integration'
+            ]
+        }
+    }
+
+
+def run_analysis(user_id, file_path: str, unique_filename: str, meal_type: str, notes: str,
+                 session_id: Optional[int] = None, progress=None) -> Tuple[Dict, int]:
+    """
+    Run the whole pipeline for one uploaded image
+    
+    Used by the synchronous /analyze route and by background analysis jobs.
+    
+    Args:
+        session_id: Pending session to complete (async jobs); None inserts a new one
+        progress: Optional progress(stage, **data) callback for stage events
+        
+    Returns:
+        Tuple of (response body, HTTP status code)
+    """
+    started = time.perf_counter()
+    usda_service = get_usda_service()
+    # USDA lookups started ahead of enrichment: while Gemini streams, and for
+    # the first-pass ingredients while a re-analysis is in flight
+    speculation = SpeculativeLookups(usda_service)
+    
+    def on_ingredient(ingredient):
+        # Runs on the event loop while Gemini is still generating: only queue the lookup
+        name = ingredient.get('name', 'Unknown')
+        if name not in speculation.futures:
+            speculation.start(name)
+            if progress:
+                progress('ingredient_detected', ingredient=ingredient)
+    
+    if progress:
+        progress('gemini_started')
+    analysis_result = analyze_image(file_path, on_ingredient=on_ingredient)
+    if progress:
+        progress(
+            'gemini_finished',
+            main_food=analysis_result.get('main_food', {}),
+            ingredient_count=len(analysis_result.get('ingredients', [])),
+            confidence=analysis_result.get('confidence_overall')
+        )
+    
+    if analysis_result.get('analysis_status') == 'failed':
+        return {
+            'error': 'Food analysis failed', 
+            'details': analysis_result.get('error', 'Unknown error')
+        }, 500
+    
+    print(f"🔍 Raw Gemini Analysis Result:")
+    print(f"   Confidence Overall: {analysis_result.get('confidence_overall')}")
+    print(f"   Main Food: {analysis_result.get('main_food', {})}")
+    print(f"   Ingredients: {len(analysis_result.get('ingredients', []))}")
+    
+    actual_confidence = resolve_confidence(analysis_result)
+    
+    # Low confidence (opt-in): re-analyse inline only if it fits the latency
+    # budget, otherwise save the first pass now and apply the refinement later.
+    # Ingredients that survive re-analysis reuse the lookups started meanwhile.
+    deferred = None
+    if pipeline_reanalysis_enabled():
+        refined_result, deferred = run_async(get_reanalysis_policy().refine(
+            get_gemini_service(), file_path, analysis_result, actual_confidence, time.perf_counter() - started,
+            speculation=speculation
+        ))
+        if refined_result is not analysis_result:
+            analysis_result = refined_result
+            actual_confidence = resolve_confidence(analysis_result)
+    
+    enriched_ingredients, total_nutrition = enrich_ingredients(
+        analysis_result.get('ingredients', []), usda_service, progress=progress, prefetched=speculation.futures
+    )
+    if progress:
+        progress('totals_computed', total_nutrition=total_nutrition, confidence=actual_confidence)
+    
+    # FIX 3: Database operations with proper data saving
+    conn = get_db_connection()
+    if not conn:
+        return {'error': 'Database connection failed'}, 500
+    
+    cursor = conn.cursor(dictionary=True)
+    
+    try:
+        persisted = persist_analysis(
+            cursor, user_id, file_path, unique_filename, analysis_result,
+            enriched_ingredients, total_nutrition, actual_confidence,
+            meal_type, notes, session_id=session_id
+        )
+        conn.commit()
+        if progress:
+            progress('persisted', session_id=persisted['session_id'], user_meal_id=persisted['user_meal_id'])
+        if deferred is not None:
+            schedule_refinement(
+                deferred, user_id, persisted['session_id'], analysis_result, total_nutrition,
+                prefetched=speculation.futures
+            )
+        
+        body = build_analysis_response(
+            persisted, analysis_result, total_nutrition, actual_confidence, meal_type
+        )
+        body['analysis_result']['reanalysis_pending'] = deferred is not None
+        return body, 200
+    
+    except Exception as db_error:
+        conn.rollback()
+        logging.error(f"Database error: {db_error}")
+        return {
+            'error': 'Database operation failed',
+            'details': str(db_error)
+        }, 500
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def schedule_refinement(deferred, user_id, session_id: int, first_result: Dict, total_nutrition: Dict,
+                        prefetched: Optional[Dict] = None):
+    """Apply a deferred re-analysis to the saved session when it finishes"""
+    from .analysis_jobs import get_analysis_job_runner
+    
+    def on_done(future):
+        # Runs on the event loop thread: hand the database work to the job pool
+        if future.cancelled() or future.exception() is not None:
+            return
+        refined_result = future.result()
+        if refined_result is first_result or refined_result.get('analysis_status') == 'failed':
+            return  # re-analysis fell back to the first pass
+        get_analysis_job_runner().submit_task(
+            apply_refined_analysis, user_id, session_id, refined_result, total_nutrition, prefetched
+        )
+    
+    deferred.add_done_callback(on_done)
+
+
+def apply_refined_analysis(user_id, session_id: int, refined_result: Dict, previous_nutrition: Dict,
+                           prefetched: Optional[Dict] = None) -> bool:
+    """
+    Replace a saved session's ingredients with a re-analysed result
+    
+    The session row is updated in place and only the difference to the
+    first pass is added to the daily summary (meal_count is unchanged).
+    
+    Args:
+        previous_nutrition: Total nutrition saved for the first pass
+        prefetched: First-pass USDA lookups by name, reused for surviving ingredients
+        
+    Returns:
+        True if the refinement was written
+    """
+    actual_confidence = resolve_confidence(refined_result)
+    enriched_ingredients, total_nutrition = enrich_ingredients(
+        refined_result.get('ingredients', []), prefetched=prefetched
+    )
+    
+    conn = get_db_connection()
+    if not conn:
+        logging.error(f"Could not apply re-analysis to session {session_id}: database unavailable")
+        return False
+    
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT fas.created_at, um.meal_date,
+                   (SELECT food_id FROM detected_ingredients WHERE session_id = fas.id LIMIT 1) AS main_food_id
+            FROM food_analysis_sessions fas
+            LEFT JOIN user_meals um ON um.session_id = fas.id
+            WHERE fas.id = %s AND fas.user_id = %s
+            LIMIT 1
+        """, (session_id, user_id))
+        session_data = cursor.fetchone()
+        if not session_data:
+            return False
+        
+        cursor.execute("DELETE FROM detected_ingredients WHERE session_id = %s", (session_id,))
+        insert_detected_ingredients(cursor, session_id, session_data['main_food_id'], enriched_ingredients)
+        
+        cursor.execute("""
+            UPDATE food_analysis_sessions
+            SET gemini_analysis_raw = %s, total_estimated_calories = %s, confidence_score = %s, updated_at = %s
+            WHERE id = %s
+        """, (
+            json.dumps(refined_result),
+            Decimal(str(total_nutrition.get('calories', 0))),
+            Decimal(str(actual_confidence)),
+            datetime.now(),
+            session_id
+        ))
+        
+        meal_date = session_data['meal_date'] or session_data['created_at'].date()
+        delta = {key: total_nutrition[key] - previous_nutrition.get(key, 0) for key in total_nutrition}
+        add_to_daily_summary(cursor, user_id, meal_date, delta, meal_count=0)
+        
+        conn.commit()
+        print(f"✅ Applied deferred re-analysis to session {session_id}: "
+              f"{delta['calories']:+.1f} cal, confidence {actual_confidence}")
+        return True
+    
+    except Exception as db_error:
+        conn.rollback()
+        logging.error(f"Could not apply re-analysis to session {session_id}: {db_error}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def run_batch_analysis(user_id, uploads: List[Tuple[str, str]], meal_type: str, notes: str) -> Tuple[Dict, int]:
+    """
+    Analyze several images of one meal together
+    
+    Gemini sees the images in as few multi-image prompts as possible, USDA
+    lookups are shared by every dish (an ingredient appearing on several
+    plates is looked up once), and all sessions plus one combined
+    daily-summary increment are written in a single transaction.
+    
+    Args:
+        uploads: (file_path, unique_filename) per stored image
+        
+    Returns:
+        Tuple of (response body, HTTP status code)
+    """
+    results = run_async(get_gemini_service().analyze_food_images([file_path for file_path, _ in uploads]))
+    
+    dishes = []
+    failed_images = []
+    for (file_path, unique_filename), analysis_result in zip(uploads, results):
+        if analysis_result.get('analysis_status') == 'failed':
+            failed_images.append({
+                'image_filename': unique_filename,
+                'error': analysis_result.get('error', 'Unknown error')
+            })
+        else:
+            dishes.append({
+                'file_path': file_path,
+                'unique_filename': unique_filename,
+                'analysis_result': analysis_result,
+                'confidence': resolve_confidence(analysis_result)
+            })
+    
+    if not dishes:
+        return {
+            'error': 'Food analysis failed',
+            'details': failed_images
+        }, 500
+    
+    # One enrichment pass over every dish's ingredients, then split back per dish
+    all_ingredients = [
+        ingredient for dish in dishes for ingredient in dish['analysis_result'].get('ingredients', [])
+    ]
+    enriched_all, _ = enrich_ingredients(all_ingredients)
+    offset = 0
+    for dish in dishes:
+        count = len(dish['analysis_result'].get('ingredients', []))
+        dish['enriched_ingredients'] = enriched_all[offset:offset + count]
+        dish['total_nutrition'] = sum_nutrition(
+            enriched['nutrition'] for enriched in dish['enriched_ingredients']
+        )
+        offset += count
+    
+    conn = get_db_connection()
+    if not conn:
+        return {'error': 'Database connection failed'}, 500
+    
+    cursor = conn.cursor(dictionary=True)
+    
+    try:
+        responses = []
+        for dish in dishes:
+            persisted = persist_analysis(
+                cursor, user_id, dish['file_path'], dish['unique_filename'], dish['analysis_result'],
+                dish['enriched_ingredients'], dish['total_nutrition'], dish['confidence'],
+                meal_type, notes, update_daily_summary=False
+            )
+            responses.append(build_analysis_response(
+                persisted, dish['analysis_result'], dish['total_nutrition'], dish['confidence'], meal_type
+            ))
+        
+        combined_nutrition = sum_nutrition(dish['total_nutrition'] for dish in dishes)
+        add_to_daily_summary(cursor, user_id, persisted['meal_date'], combined_nutrition, meal_count=len(dishes))
+        conn.commit()
+        
+        print(f"🎉 Batch analysis saved {len(dishes)} sessions ({len(failed_images)} images failed)")
+        
+        return {
+            'success': True,
+            'session_ids': [response['session_id'] for response in responses],
+            'results': responses,
+            'total_nutrition': combined_nutrition,
+            'failed_images': failed_images
+        }, 200
+    
+    except Exception as db_error:
+        conn.rollback()
+        logging.error(f"Database error: {db_error}")
+        return {
+            'error': 'Database operation failed',
+            'details': str(db_error)
+        }, 500
+    finally:
+        cursor.close()
+        conn.close()
+
+
+_auto_increment_step_value = None
+
+def _auto_increment_step(cursor):
+    """Server auto_increment_increment (1 unless replication spreads ids), cached per process"""
+    global _auto_increment_step_value
+    if _auto_increment_step_value is None:
+        cursor.execute("SELECT @@SESSION.auto_increment_increment AS step")
+        row = cursor.fetchone()
+        _auto_increment_step_value = int(row['step']) if row and row['step'] else 1
+    return _auto_increment_step_value
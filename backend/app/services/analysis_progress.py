@@ -0,0 +1,143 @@
+# In-process progress events for analysis sessions (consumed over SSE)
+import os
+import time
+import threading
+from typing import Dict, Iterator, List, Optional
+
+TERMINAL_STAGES = ('completed', 'failed')
+
+
+class ProgressChannel:
+    def __init__(self, session_id: int):
+        """
+        Ordered, replayable event log for one analysis session
+
+        Subscribers read from the start of the log, so a client that connects
+        after the job has begun still receives every stage.
+
+        Args:
+            session_id: Analysis session the events belong to
+        """
+        self.session_id = session_id
+        self.started = time.perf_counter()
+        self.closed_at = None
+        self._events: List[Dict] = []
+        self._last = self.started
+        self._cond = threading.Condition()
+
+    @property
+    def closed(self) -> bool:
+        return self.closed_at is not None
+
+    def publish(self, stage: str, **data) -> Dict:
+        """
+        Append a stage event with timings
+
+        Args:
+            stage: Stage name (e.g. 'gemini_finished')
+            data: JSON-serializable payload for the event
+
+        Returns:
+            The stored event, including elapsed_ms since the channel opened
+            and stage_ms since the previous event
+        """
+        with self._cond:
+            now = time.perf_counter()
+            event = {
+                'id': len(self._events),
+                'session_id': self.session_id,
+                'stage': stage,
+                'elapsed_ms': round((now - self.started) * 1000, 1),
+                'stage_ms': round((now - self._last) * 1000, 1),
+                'data': data
+            }
+            self._last = now
+            self._events.append(event)
+            if stage in TERMINAL_STAGES:
+                self.closed_at = time.monotonic()
+            self._cond.notify_all()
+            return event
+
+    def events(self, heartbeat: float = 15.0, timeout: Optional[float] = None) -> Iterator[Optional[Dict]]:
+        """
+        Yield events as they are published until a terminal stage
+
+        Yields None every `heartbeat` seconds without news so the caller can
+        keep the HTTP connection alive; stops after `timeout` seconds overall.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        position = 0
+        while True:
+            with self._cond:
+                if position >= len(self._events) and not self.closed:
+                    wait = heartbeat
+                    if deadline is not None:
+                        wait = min(wait, deadline - time.monotonic())
+                    if wait > 0:
+                        self._cond.wait(wait)
+                pending = self._events[position:]
+                position += len(pending)
+                finished = self.closed and position >= len(self._events)
+
+            if pending:
+                yield from pending
+            elif not finished:
+                yield None
+            if finished or (deadline is not None and time.monotonic() >= deadline):
+                return
+
+
+class ProgressBroker:
+    def __init__(self, retention: float = 300.0):
+        """
+        Registry of progress channels by session id
+
+        Finished channels are kept for `retention` seconds so late subscribers
+        can still replay them.
+        """
+        self.retention = float(retention)
+        self._channels: Dict[int, ProgressChannel] = {}
+        self._lock = threading.Lock()
+
+    def open(self, session_id: int) -> ProgressChannel:
+        with self._lock:
+            self._purge()
+            channel = self._channels.get(session_id)
+            if channel is None:
+                channel = self._channels[session_id] = ProgressChannel(session_id)
+            return channel
+
+    def get(self, session_id: int) -> Optional[ProgressChannel]:
+        with self._lock:
+            return self._channels.get(session_id)
+
+    def _purge(self):
+        now = time.monotonic()
+        expired = [
+            session_id for session_id, channel in self._channels.items()
+            if channel.closed and now - channel.closed_at > self.retention
+        ]
+        for session_id in expired:
+            del self._channels[session_id]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'channels': len(self._channels),
+                'active': sum(1 for channel in self._channels.values() if not channel.closed)
+            }
+
+
+_broker: Optional[ProgressBroker] = None
+_broker_lock = threading.Lock()
+
+
+def get_progress_broker() -> ProgressBroker:
+    """Return the process-wide progress broker"""
+    global _broker
+
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = ProgressBroker(retention=float(os.getenv('ANALYSIS_EVENTS_RETENTION', 300)))
+    return _broker
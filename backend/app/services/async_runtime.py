@@ -0,0 +1,74 @@
+# Long-lived asyncio event loop shared by request threads
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Optional
+
+
+class BackgroundEventLoop:
+    def __init__(self, name: str = 'async-runtime'):
+        """
+        Run one asyncio event loop forever on a daemon thread
+
+        Request threads hand coroutines to it instead of creating and closing
+        a loop per request, so in-flight API calls share this loop (and its
+        open channels) rather than pinning one thread each.
+
+        Args:
+            name: Thread name, useful in stack dumps
+        """
+        self.name = name
+        self.loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._started.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+
+    def submit(self, coro) -> Future:
+        """Schedule a coroutine on the loop and return a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the loop and block the calling thread for its result"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+_runtime: Optional[BackgroundEventLoop] = None
+_runtime_pid = None
+_runtime_lock = threading.Lock()
+
+
+def get_async_runtime() -> BackgroundEventLoop:
+    """Return this worker's background event loop (recreated after fork)"""
+    global _runtime, _runtime_pid
+
+    if _runtime is None or _runtime_pid != os.getpid():
+        with _runtime_lock:
+            if _runtime is None or _runtime_pid != os.getpid():
+                _runtime = BackgroundEventLoop()
+                _runtime_pid = os.getpid()
+                logging.info("Started background event loop")
+    return _runtime
+
+
+def run_async(coro, timeout: Optional[float] = None):
+    """Run a coroutine on the shared background loop from synchronous code"""
+    return get_async_runtime().run(coro, timeout)
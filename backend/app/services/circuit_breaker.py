@@ -0,0 +1,139 @@
+# Circuit breaker for outbound API calls
+import os
+import time
+import threading
+from typing import Dict, Optional
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an API whose breaker is open"""
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Stop calling an API after consecutive failures
+
+        After `failure_threshold` failed calls in a row the breaker opens and
+        callers fail fast for `reset_timeout` seconds. Then a single probe call
+        is let through (half-open): success closes the breaker, failure opens
+        it for another `reset_timeout`.
+
+        Args:
+            name: API name, used in error messages
+            failure_threshold: Consecutive failures that open the breaker
+            reset_timeout: Seconds to stay open before probing again
+        """
+        self.name = name
+        self.failure_threshold = max(int(failure_threshold), 1)
+        self.reset_timeout = float(reset_timeout)
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+        self._stats = {
+            'calls': 0,
+            'successes': 0,
+            'failures': 0,
+            'rejected': 0,
+            'opened': 0
+        }
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probing = False
+        return self._state
+
+    def allow(self) -> bool:
+        """
+        Admit a call or raise CircuitOpenError
+
+        Every admitted call must be followed by record_success, record_failure
+        or release.
+
+        Returns:
+            True if this call is the half-open probe (pass it to release)
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == OPEN or (state == HALF_OPEN and self._probing):
+                self._stats['rejected'] += 1
+                retry_in = max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+                raise CircuitOpenError(f"{self.name} circuit breaker is open (retry in {retry_in:.0f}s)")
+            self._stats['calls'] += 1
+            if state == HALF_OPEN:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._stats['successes'] += 1
+            self._failures = 0
+            self._state = CLOSED
+            self._probing = False
+
+    def release(self, probe: bool = False):
+        """
+        Give back an admitted call that never reached the API (no outcome recorded)
+
+        Args:
+            probe: What allow() returned for this call; only the probe itself
+                frees the half-open slot, not a call admitted while closed
+        """
+        with self._lock:
+            self._stats['calls'] -= 1
+            if probe:
+                self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._stats['failures'] += 1
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self._stats['opened'] += 1
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self._stats,
+                'state': self._current_state(),
+                'consecutive_failures': self._failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_timeout_seconds': self.reset_timeout
+            }
+
+
+_gemini_breaker: Optional[CircuitBreaker] = None
+_gemini_breaker_lock = threading.Lock()
+
+
+def get_gemini_breaker() -> CircuitBreaker:
+    """Return the process-wide breaker guarding Gemini calls"""
+    global _gemini_breaker
+
+    if _gemini_breaker is None:
+        with _gemini_breaker_lock:
+            if _gemini_breaker is None:
+                _gemini_breaker = CircuitBreaker(
+                    'Gemini',
+                    failure_threshold=int(os.getenv('GEMINI_BREAKER_THRESHOLD', 5)),
+                    reset_timeout=float(os.getenv('GEMINI_BREAKER_RESET', 30))
+                )
+    return _gemini_breaker
@@ -0,0 +1,58 @@
+# Process-wide API clients shared by all requests in a worker
+import logging
+import threading
+from typing import Optional
+
+from .gemini_service import GeminiService
+from .usda_service import USDAService
+
+_gemini_service: Optional[GeminiService] = None
+_usda_service: Optional[USDAService] = None
+_clients_lock = threading.Lock()
+
+
+def get_gemini_service() -> GeminiService:
+    """Return the worker's shared GeminiService (created on first use)"""
+    global _gemini_service
+
+    if _gemini_service is None:
+        with _clients_lock:
+            if _gemini_service is None:
+                _gemini_service = GeminiService()
+    return _gemini_service
+
+
+def get_usda_service() -> USDAService:
+    """Return the worker's shared USDAService (created on first use)"""
+    global _usda_service
+
+    if _usda_service is None:
+        with _clients_lock:
+            if _usda_service is None:
+                _usda_service = USDAService()
+    return _usda_service
+
+
+def warm_up_clients():
+    """Open the HTTP/TLS connections both clients will reuse for real requests"""
+    for name, service in (('USDA', get_usda_service()), ('Gemini', get_gemini_service())):
+        try:
+            service.warm_up()
+            logging.info(f"{name} client warmed up")
+        except Exception as e:
+            logging.warning(f"{name} client warm-up failed: {e}")
+
+
+def init_service_clients(app):
+    """
+    Create the shared GeminiService and USDAService for this worker
+
+    With SERVICE_WARMUP enabled, connections are pre-opened on a background
+    thread so startup is not delayed and the first analysis after a deploy
+    does not pay for DNS, TCP and TLS setup.
+    """
+    app.extensions['gemini_service'] = get_gemini_service()
+    app.extensions['usda_service'] = get_usda_service()
+
+    if app.config.get('SERVICE_WARMUP'):
+        threading.Thread(target=warm_up_clients, name='client-warmup', daemon=True).start()
@@ -1,28 +1,34 @@
 # Food Analysis Service - Main orchestrator
 import os
+import time
 import uuid
+import asyncio
+import functools
 import logging
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 from PIL import Image
 import json
 
-from .gemini_service import GeminiService
-from .usda_service import USDAService
+from .clients import get_gemini_service, get_usda_service
+from .reanalysis import SpeculativeLookups, get_reanalysis_policy
 # from .fatsecret_service import FatSecretService  # Optional alternative
 
 class FoodAnalysisService:
     def __init__(self):
         """Initialize the food analysis service with all required APIs"""
-        self.gemini_service = GeminiService()
-        self.usda_service = USDAService()
+        self.gemini_service = get_gemini_service()
+        self.usda_service = get_usda_service()
         # self.fatsecret_service = FatSecretService()  # Optional
         
-        # Analysis configuration
-        self.confidence_threshold = 0.7
+        # Analysis configuration: re-analysis threshold and latency budget
+        # come from the shared policy (REANALYSIS_THRESHOLD, REANALYSIS_DEADLINE)
+        self.reanalysis_policy = get_reanalysis_policy()
+        self.confidence_threshold = self.reanalysis_policy.threshold
         self.max_retry_attempts = 2
         
-    async def analyze_food_image(self, image_path: str, user_id: int, meal_type: str = 'lunch', notes: str = '') -> Dict:
+    async def analyze_food_image(self, image_path: str, user_id: int, meal_type: str = 'lunch', notes: str = '',
+                                 on_refined: Optional[Callable[[Dict], None]] = None) -> Dict:
         """
         Main method to analyze food image and return complete nutrition data
         
@@ -31,6 +37,8 @@ class FoodAnalysisService:
             user_id: ID of the user requesting analysis
             meal_type: Type of meal (breakfast, lunch, dinner, snack)
             notes: Optional user notes
+            on_refined: Called with the refined Gemini result when a deferred
+                re-analysis finishes (on the event loop thread, must not block)
             
         Returns:
             Complete analysis result with nutrition data
@@ -38,22 +46,36 @@ class FoodAnalysisService:
         try:
             # Generate session ID
             session_id = str(uuid.uuid4())
+            started = time.perf_counter()
             
             # Step 1: Analyze image with Gemini
             logging.info(f"Starting Gemini analysis for session {session_id}")
             gemini_result = await self.gemini_service.analyze_food_image(image_path)
             
-            # Step 2: Validate confidence and retry if needed
-            if gemini_result['confidence_overall'] < self.confidence_threshold:
-                logging.info(f"Low confidence ({gemini_result['confidence_overall']:.2f}), retrying analysis")
-                gemini_result = await self.gemini_service.reanalyze_with_context(image_path, gemini_result)
+            # Step 2: Low confidence - re-analyse within the latency budget or defer it
+            # (USDA lookups for the first-pass ingredients run meanwhile and are reused)
+            first_result = gemini_result
+            speculation = SpeculativeLookups(self.usda_service)
+            gemini_result, deferred = await self.reanalysis_policy.refine(
+                self.gemini_service, image_path, gemini_result,
+                gemini_result['confidence_overall'], time.perf_counter() - started,
+                speculation=speculation
+            )
+            if deferred is not None and on_refined is not None:
+                def deliver(future):
+                    if future.cancelled() or future.exception() is not None:
+                        return
+                    if future.result() is not first_result:
+                        on_refined(future.result())
+                
+                deferred.add_done_callback(deliver)
             
             # Step 3: Enrich with nutrition data dan save to database
             main_food_data = gemini_result.get('main_food', {})
             ingredients_data = gemini_result.get('ingredients', [])
             
             enriched_result = await self._process_food_and_ingredients(
-                main_food_data, ingredients_data, session_id, user_id
+                main_food_data, ingredients_data, session_id, user_id, prefetched=speculation.futures
             )
             
             # Step 4: Calculate total nutrition
@@ -71,6 +93,7 @@ class FoodAnalysisService:
                     'path': image_path,
                     'filename': os.path.basename(image_path)
                 },
+                'reanalysis_pending': deferred is not None,
                 'gemini_analysis': {
                     'confidence_overall': gemini_result['confidence_overall'],
                     'image_quality': gemini_result.get('image_quality', 'unknown'),
@@ -95,7 +118,8 @@ class FoodAnalysisService:
                 'created_at': datetime.utcnow().isoformat()
             }
     
-    async def _process_food_and_ingredients(self, main_food_data: Dict, ingredients_data: List[Dict], session_id: str, user_id: int) -> Dict:
+    async def _process_food_and_ingredients(self, main_food_data: Dict, ingredients_data: List[Dict], session_id: str, user_id: int,
+                                            prefetched: Optional[Dict] = None) -> Dict:
         """
         Process main food and ingredients with nutrition enrichment and database saving
         
@@ -104,6 +128,7 @@ class FoodAnalysisService:
             ingredients_data: List of ingredients from Gemini
             session_id: Analysis session ID
             user_id: User ID
+            prefetched: USDA lookups already started for these names
             
         Returns:
             Dict containing processed main food, enriched ingredients, and database IDs
@@ -140,11 +165,18 @@ class FoodAnalysisService:
                 'fiber': 0, 'sugar': 0, 'sodium': 0, 'calcium': 0, 'iron': 0
             }
             
-            for ingredient in ingredients_data:
+            # Enrich with USDA nutrition data, all ingredients in parallel (off the event loop)
+            usda_results = await asyncio.get_running_loop().run_in_executor(
+                None,
+                functools.partial(
+                    self.usda_service.search_foods_concurrently,
+                    [ingredient.get('name', 'Unknown') for ingredient in ingredients_data],
+                    pending=prefetched
+                )
+            )
+            
+            for ingredient, nutrition_data in zip(ingredients_data, usda_results):
                 try:
-                    # Enrich with USDA nutrition data
-                    nutrition_data = self.usda_service.search_food(ingredient['name'])
-                    
                     # Convert portion to grams
                     portion_grams = self._convert_to_grams(
                         ingredient['estimated_portion'], 
@@ -253,12 +285,15 @@ class FoodAnalysisService:
         """
         enriched_foods = []
         
-        for food in detected_foods:
+        # Search for nutrition data for all foods in parallel (off the event loop)
+        usda_results = await asyncio.get_running_loop().run_in_executor(
+            None,
+            self.usda_service.search_foods_concurrently,
+            [food.get('name', 'Unknown') for food in detected_foods]
+        )
+        
+        for food, nutrition_data in zip(detected_foods, usda_results):
             try:
-                logging.info(f"Searching USDA data for: {food['name']}")
-                # Search for nutrition data
-                nutrition_data = self.usda_service.search_food(food['name'])
-                
                 # Convert portion to grams
                 portion_grams = self._convert_to_grams(
                     food['estimated_portion'], 
@@ -0,0 +1,65 @@
+# Scoring USDA candidates against an ingredient name
+import re
+from typing import Iterable, List
+
+# Preferred when descriptions match equally well: lab-analysed generic foods
+# first, then the legacy reference set, then survey (recipe) foods
+DATA_TYPE_PREFERENCE = {
+    'Foundation': 1.0,
+    'SR Legacy': 0.8,
+    'Survey (FNDDS)': 0.6
+}
+_OTHER_DATA_TYPE = 0.3  # Branded, Experimental, ...
+
+_STOPWORDS = {'and', 'or', 'with', 'without', 'of', 'in', 'the', 'to', 'for', 'from', 'as', 'by'}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens with simple plural folding (eggs -> egg, berries -> berry)"""
+    tokens = []
+    for token in re.findall(r'[a-z0-9]+', str(text).lower()):
+        if len(token) < 2 or token in _STOPWORDS:
+            continue
+        if token.endswith('ies') and len(token) > 4:
+            token = token[:-3] + 'y'
+        elif token.endswith('oes') and len(token) > 4:
+            token = token[:-2]
+        elif token.endswith('s') and not token.endswith('ss') and len(token) > 3:
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def score_candidate(query_tokens: Iterable[str], description: str, data_type: str, completeness: float) -> float:
+    """
+    How well a USDA food answers a query, between 0 and 1
+
+    Mostly token overlap: the share of query tokens the description contains,
+    then how little else it contains (generic 'Egg, whole, raw' over 'Egg
+    salad sandwich'), then data type preference and nutrient completeness.
+
+    Args:
+        query_tokens: tokenize(query)
+        description: Candidate food description
+        data_type: Candidate FDC data type
+        completeness: Share of the tracked nutrients the candidate reports (0-1)
+    """
+    query = set(query_tokens)
+    if not query:
+        return 0.0
+    described = set(tokenize(description))
+    matched = len(query & described)
+    coverage = matched / len(query)
+    precision = matched / len(described) if described else 0.0
+    return (
+        0.6 * coverage
+        + 0.2 * precision
+        + 0.1 * DATA_TYPE_PREFERENCE.get(data_type, _OTHER_DATA_TYPE)
+        + 0.1 * completeness
+    )
+
+
+def token_coverage(query_tokens: Iterable[str], description: str) -> float:
+    """Share of query tokens present in the description"""
+    query = set(query_tokens)
+    return len(query & set(tokenize(description))) / len(query) if query else 0.0
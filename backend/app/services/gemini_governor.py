@@ -0,0 +1,250 @@
+# Host-wide concurrency and rate governor for Gemini calls
+import os
+import time
+import fcntl
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+
+from .rate_limiter import TokenBucket
+
+
+class GovernorTimeout(Exception):
+    """No Gemini slot became free within the governor's acquire timeout"""
+
+
+class LocalGovernorBackend:
+    def __init__(self, max_in_flight: int, rpm: float):
+        """
+        Slots and rate budget shared by the threads of this process only
+
+        Args:
+            max_in_flight: Concurrent Gemini calls allowed
+            rpm: Gemini requests allowed per minute
+        """
+        self.max_in_flight = max(int(max_in_flight), 1)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._bucket = TokenBucket(rate=rpm / 60.0, burst=self.max_in_flight)
+
+    def try_acquire_slot(self):
+        with self._lock:
+            if self._in_flight >= self.max_in_flight:
+                return None
+            self._in_flight += 1
+            return True
+
+    def release_slot(self, slot):
+        with self._lock:
+            self._in_flight -= 1
+
+    def reserve_request(self) -> float:
+        return self._bucket.reserve()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'backend': 'local', 'in_flight': self._in_flight}
+
+
+class FileGovernorBackend:
+    def __init__(self, directory: str, max_in_flight: int, rpm: float):
+        """
+        Slots and rate budget shared by every worker process on the host
+
+        Each slot is a lock file held with a non-blocking flock for the
+        duration of a call, so a crashed worker's slots are released by the
+        kernel. The rate budget is a token bucket whose state lives in a small
+        file, updated under an exclusive flock.
+
+        Args:
+            directory: Directory for the lock and state files
+            max_in_flight: Concurrent Gemini calls allowed host-wide
+            rpm: Gemini requests allowed per minute host-wide
+        """
+        self.directory = directory
+        self.max_in_flight = max(int(max_in_flight), 1)
+        self.rate = max(float(rpm), 1e-6) / 60.0
+        self.burst = float(self.max_in_flight)
+        os.makedirs(directory, exist_ok=True)
+        self._rate_path = os.path.join(directory, 'rate.state')
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire_slot(self):
+        """Return an open, locked slot file descriptor, or None if all slots are taken"""
+        for index in range(self.max_in_flight):
+            fd = os.open(os.path.join(self.directory, f'slot-{index}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            with self._lock:
+                self._in_flight += 1
+            return fd
+        return None
+
+    def release_slot(self, slot):
+        try:
+            fcntl.flock(slot, fcntl.LOCK_UN)
+        finally:
+            os.close(slot)
+            with self._lock:
+                self._in_flight -= 1
+
+    def reserve_request(self) -> float:
+        """Take a token from the host-wide bucket; returns seconds to wait before using it"""
+        fd = os.open(self._rate_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            raw = os.pread(fd, 64, 0).decode('ascii', 'ignore').split()
+            now = time.time()
+            try:
+                tokens, updated = float(raw[0]), float(raw[1])
+            except (IndexError, ValueError):
+                tokens, updated = self.burst, now
+
+            # Same reservation rule as TokenBucket: going into debt queues later callers
+            tokens = min(self.burst, tokens + max(now - updated, 0.0) * self.rate) - 1
+            state = f'{tokens:.6f} {now:.6f}'.ljust(64).encode('ascii')
+            os.pwrite(fd, state, 0)
+            return -tokens / self.rate if tokens < 0 else 0.0
+        finally:
+            os.close(fd)  # closing drops the flock
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'backend': 'file', 'directory': self.directory, 'in_flight': self._in_flight}
+
+
+_BACKENDS: Dict[str, Callable[..., object]] = {
+    'local': lambda max_in_flight, rpm: LocalGovernorBackend(max_in_flight, rpm),
+    'file': lambda max_in_flight, rpm: FileGovernorBackend(
+        os.getenv('GEMINI_GOVERNOR_DIR', os.path.join('cache', 'gemini_governor')), max_in_flight, rpm
+    )
+}
+
+
+def register_governor_backend(name: str, factory: Callable[..., object]):
+    """
+    Make a backend selectable with GEMINI_GOVERNOR_BACKEND=<name>
+
+    Args:
+        factory: Called as factory(max_in_flight, rpm); the backend provides
+            try_acquire_slot, release_slot, reserve_request and stats
+    """
+    _BACKENDS[name] = factory
+
+
+class GeminiGovernor:
+    def __init__(self, backend, max_in_flight: int, rpm: float, acquire_timeout: float = 30.0):
+        """
+        Admit Gemini calls within a shared concurrency and rate budget
+
+        Args:
+            backend: Slot/rate storage (local, file or a registered backend)
+            max_in_flight: Concurrent calls allowed (for stats)
+            rpm: Requests per minute allowed (for stats)
+            acquire_timeout: Seconds to wait for a slot before giving up
+        """
+        self.backend = backend
+        self.max_in_flight = max_in_flight
+        self.rpm = rpm
+        self.acquire_timeout = float(acquire_timeout)
+        self._lock = threading.Lock()
+
+        self._stats = {
+            'acquired': 0,
+            'queued': 0,
+            'timeouts': 0,
+            'queued_seconds': 0.0,
+            'throttled_seconds': 0.0
+        }
+
+    def _add(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self._stats[key] += value
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold one Gemini call slot (and one request of rate budget) for the block
+
+        Raises:
+            GovernorTimeout: No slot freed up within acquire_timeout
+        """
+        started = time.monotonic()
+        delay = 0.01
+        slot = await self._acquire_slot()
+        while slot is None:
+            if time.monotonic() - started >= self.acquire_timeout:
+                self._add(timeouts=1)
+                raise GovernorTimeout(f"No Gemini slot free after {self.acquire_timeout:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.25)
+            slot = await self._acquire_slot()
+        queued = time.monotonic() - started
+
+        try:
+            # The file backend flocks the shared rate state; never block the event loop on it
+            throttle = await asyncio.get_running_loop().run_in_executor(None, self.backend.reserve_request)
+            if throttle:
+                await asyncio.sleep(throttle)
+            self._add(acquired=1, queued=int(queued > 0.001), queued_seconds=queued, throttled_seconds=throttle)
+            yield
+        finally:
+            self.backend.release_slot(slot)
+
+    async def _acquire_slot(self):
+        """try_acquire_slot off the event loop thread; a slot won after cancellation is released"""
+        future = asyncio.get_running_loop().run_in_executor(None, self.backend.try_acquire_slot)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            def release_orphan(done):
+                if not done.cancelled() and done.exception() is None and done.result() is not None:
+                    self.backend.release_slot(done.result())
+            future.add_done_callback(release_orphan)
+            raise
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self._stats,
+                **self.backend.stats(),
+                'queued_seconds': round(self._stats['queued_seconds'], 3),
+                'throttled_seconds': round(self._stats['throttled_seconds'], 3),
+                'max_in_flight': self.max_in_flight,
+                'requests_per_minute': self.rpm
+            }
+
+
+_governor: Optional[GeminiGovernor] = None
+_governor_pid = None
+_governor_lock = threading.Lock()
+
+
+def get_gemini_governor() -> GeminiGovernor:
+    """Return this worker's Gemini governor (recreated after fork), configured from the environment"""
+    global _governor, _governor_pid
+
+    if _governor is None or _governor_pid != os.getpid():
+        with _governor_lock:
+            if _governor is None or _governor_pid != os.getpid():
+                max_in_flight = max(int(os.getenv('GEMINI_MAX_IN_FLIGHT', 4)), 1)
+                rpm = float(os.getenv('GEMINI_RPM', 60))
+                name = os.getenv('GEMINI_GOVERNOR_BACKEND', 'file')
+                try:
+                    backend = _BACKENDS[name](max_in_flight, rpm)
+                except Exception as e:
+                    logging.warning(f"Gemini governor backend '{name}' unavailable ({e}), using per-process limits")
+                    backend = LocalGovernorBackend(max_in_flight, rpm)
+                _governor = GeminiGovernor(
+                    backend, max_in_flight, rpm,
+                    acquire_timeout=float(os.getenv('GEMINI_GOVERNOR_TIMEOUT', 30))
+                )
+                _governor_pid = os.getpid()
+    return _governor
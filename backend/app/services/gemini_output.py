@@ -0,0 +1,124 @@
+# Compact, schema-constrained Gemini output format
+import threading
+from typing import Dict
+
+# Short key -> field name of the regular analysis result
+DISH_KEYS = {
+    's': 'analysis_status',
+    'c': 'confidence_overall',
+    'm': 'main_food',
+    'i': 'ingredients',
+    'q': 'image_quality',
+    'x': 'additional_notes'
+}
+MAIN_FOOD_KEYS = {'n': 'name', 'd': 'description', 'p': 'estimated_portion', 'u': 'portion_unit', 'c': 'confidence'}
+INGREDIENT_KEYS = {'n': 'name', 'g': 'category', 'p': 'estimated_portion', 'u': 'portion_unit', 'c': 'confidence'}
+
+_INGREDIENT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'n': {'type': 'string'},
+        'g': {'type': 'string'},
+        'p': {'type': 'number'},
+        'u': {'type': 'string'},
+        'c': {'type': 'number'}
+    },
+    'required': ['n', 'g', 'p', 'c']
+}
+
+DISH_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        's': {'type': 'string', 'enum': ['success', 'partial', 'failed']},
+        'c': {'type': 'number'},
+        'm': {
+            'type': 'object',
+            'properties': {
+                'n': {'type': 'string'},
+                'd': {'type': 'string'},
+                'p': {'type': 'number'},
+                'u': {'type': 'string'},
+                'c': {'type': 'number'}
+            },
+            'required': ['n', 'p', 'c']
+        },
+        'i': {'type': 'array', 'items': _INGREDIENT_SCHEMA},
+        'q': {'type': 'string', 'enum': ['good', 'fair', 'poor']},
+        'x': {'type': 'string'}
+    },
+    'required': ['s', 'c', 'm', 'i']
+}
+
+BATCH_SCHEMA = {
+    'type': 'object',
+    'properties': {'dishes': {'type': 'array', 'items': DISH_SCHEMA}},
+    'required': ['dishes']
+}
+
+COMPACT_PROMPT = """
+Analyze this food image for diet tracking. Answer with JSON only, using these short keys:
+s: analysis status (success|partial|failed)
+c: overall confidence 0-1
+m: main dish {n: name (e.g. Nasi Goreng), d: short description for category matching,
+   p: estimated portion, u: portion unit (default grams), c: confidence 0-1}
+i: ingredient components, each {n: name (e.g. nasi putih, telur ayam),
+   g: category (protein, carbs, vegetables, ...), p: estimated portion, u: unit, c: confidence 0-1}
+q: image quality (good|fair|poor)
+x: brief notes, only if relevant
+"""
+
+
+def _rename(data, keys: Dict[str, str]) -> Dict:
+    if not isinstance(data, dict):
+        return data
+    return {keys.get(key, key): value for key, value in data.items()}
+
+
+def expand_ingredient(ingredient: Dict) -> Dict:
+    """Short-keyed ingredient -> regular ingredient dict"""
+    expanded = _rename(ingredient, INGREDIENT_KEYS)
+    if isinstance(expanded, dict):
+        expanded.setdefault('portion_unit', 'grams')
+    return expanded
+
+
+def expand_dish(dish: Dict) -> Dict:
+    """Short-keyed analysis -> the regular analysis result layout"""
+    if not isinstance(dish, dict) or not any(key in dish for key in ('m', 'i')):
+        return dish  # already in the long format
+    expanded = _rename(dish, DISH_KEYS)
+    main_food = _rename(expanded.get('main_food') or {}, MAIN_FOOD_KEYS)
+    if isinstance(main_food, dict):
+        main_food.setdefault('portion_unit', 'grams')
+    expanded['main_food'] = main_food
+    expanded['ingredients'] = [expand_ingredient(item) for item in expanded.get('ingredients') or []]
+    return expanded
+
+
+class OutputStats:
+    """How Gemini answers were parsed, to see how often the fallback path still fires"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {
+            'responses': 0,
+            'structured': 0,   # decoded directly as compact JSON
+            'extracted': 0,    # needed the find('{')/rfind('}') extraction
+            'fallbacks': 0     # unparseable, _create_fallback_response used
+        }
+
+    def record(self, outcome: str):
+        with self._lock:
+            self._counts['responses'] += 1
+            self._counts[outcome] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            responses = self._counts['responses']
+            return {
+                **self._counts,
+                'fallback_rate': round(self._counts['fallbacks'] / responses, 4) if responses else 0.0
+            }
+
+
+output_stats = OutputStats()
@@ -1,16 +1,59 @@
 # Gemini API Service for Food Analysis
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+import io
 import os
 import json
+import asyncio
 import logging
-from PIL import Image
 import base64
-from typing import Dict, List, Optional
-import time
+import inspect
+import random
+from typing import Callable, Dict, List, Optional
+from functools import partial
+
+from .circuit_breaker import get_gemini_breaker
+from .gemini_governor import get_gemini_governor
+from .image_cache import compute_dhash, get_gemini_image_cache
+from .image_preprocessing import preprocess_image
+from .image_sessions import get_image_session_store
+from .json_stream import StreamingArrayParser
+from .gemini_output import (
+    BATCH_SCHEMA, COMPACT_PROMPT, DISH_SCHEMA, expand_dish, expand_ingredient, output_stats
+)
+
+# response_mime_type/response_schema need a newer google-generativeai than the
+# pinned 0.3.x; without them the compact mode relies on the short-key prompt alone
+_GENERATION_CONFIG_FIELDS = getattr(getattr(genai.types, 'GenerationConfig', None), '__annotations__', {})
+_SDK_SUPPORTS_JSON_MIME = 'response_mime_type' in _GENERATION_CONFIG_FIELDS
+_SDK_SUPPORTS_SCHEMA = 'response_schema' in _GENERATION_CONFIG_FIELDS
+# The File API (genai.upload_file) likewise arrived after 0.3.x
+_SDK_SUPPORTS_FILES = hasattr(genai, 'upload_file')
+# ...and request_options (a transport timeout that also frees executor threads)
+_SDK_SUPPORTS_REQUEST_OPTIONS = 'request_options' in inspect.signature(genai.GenerativeModel.generate_content).parameters
+
+# 429 and 5xx answers are worth retrying; 4xx request errors are not
+_RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServerError,
+    asyncio.TimeoutError
+)
+# Not retried, but still a sign Gemini (or the way to it) is unhealthy; other
+# errors (4xx requests, SDK and parsing errors) say nothing about its health
+_OUTAGE_ERRORS = (
+    google_exceptions.RetryError,
+    ConnectionError
+)
 
 class GeminiService:
     def __init__(self):
-        """Initialize Gemini API client"""
+        """
+        Initialize Gemini API client
+        
+        Create it once per worker through app.services.clients; the model
+        object holds no per-request state and is safe to share across threads.
+        """
         self.api_key = os.getenv('GEMINI_API_KEY')
         if not self.api_key:
             logging.warning("GEMINI_API_KEY not found, using demo mode")
@@ -22,6 +65,36 @@ class GeminiService:
         else:
             self.model = None
         
+        # Results keyed by perceptual hash, so re-uploads skip the API call
+        self.result_cache = get_gemini_image_cache()
+        
+        # Stream responses so callers can act on ingredients before generation ends
+        self.streaming = os.getenv('GEMINI_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+        
+        # Images sent together in one multi-image prompt by analyze_food_images
+        self.batch_max_images = max(int(os.getenv('GEMINI_BATCH_MAX_IMAGES', 4)), 1)
+        
+        # JSON MIME type + response schema with short keys: fewer output tokens
+        # and no free-form text for _parse_gemini_response to dig through
+        self.structured_output = os.getenv('GEMINI_STRUCTURED_OUTPUT', 'true').lower() in ('1', 'true', 'yes')
+        
+        # Per-call deadline, bounded retries with backoff + jitter, and a breaker
+        # that fails fast into the fallback response while Gemini is unhealthy
+        self.call_timeout = float(os.getenv('GEMINI_TIMEOUT', 30))
+        self.max_retries = max(int(os.getenv('GEMINI_MAX_RETRIES', 2)), 0)
+        self.retry_backoff = float(os.getenv('GEMINI_RETRY_BACKOFF', 0.5))
+        self.breaker = get_gemini_breaker()
+        
+        # Concurrency and requests-per-minute budget shared by all workers on the host
+        self.governor = get_gemini_governor()
+        
+        # Image part sent for each upload, reused by re-analysis. With file upload
+        # the bytes go to Gemini once and follow-up prompts only send a reference.
+        self.image_sessions = get_image_session_store()
+        self.file_upload = (
+            _SDK_SUPPORTS_FILES and os.getenv('GEMINI_FILE_UPLOAD', 'false').lower() in ('1', 'true', 'yes')
+        )
+        
         # Primary food analysis prompt untuk sistem baru
         self.analysis_prompt = """
         Analyze this food image and provide detailed information in JSON format. 
@@ -60,12 +133,22 @@ class GeminiService:
         Image context: User uploaded this food image for diet tracking purposes.
         """
     
-    async def analyze_food_image(self, image_path: str) -> Dict:
+    def warm_up(self):
+        """Open the API channel with a cheap metadata call (no generation, no token cost)"""
+        if self.model is None:
+            return
+        genai.get_model(self.model.model_name)
+    
+    async def analyze_food_image(self, image_path: str,
+                                 on_ingredient: Optional[Callable[[Dict], None]] = None) -> Dict:
         """
         Analyze food image using Gemini Vision API
         
         Args:
             image_path: Path to the uploaded image
+            on_ingredient: Called on the event loop with each raw ingredient as
+                soon as it is complete in the streamed response (or for every
+                ingredient of a cached/demo result). Must not block.
             
         Returns:
             Dictionary containing analysis results
@@ -74,32 +157,47 @@ class GeminiService:
             # Check if we're in demo mode
             if self.model is None:
                 logging.info("Running in demo mode - returning sample data")
-                return self._get_demo_response()
+                return self._replay_ingredients(self._get_demo_response(), on_ingredient)
+            
+            # Load and prepare image: downsized, oriented, metadata-free JPEG/WebP in memory
+            prepared, image_hash = await self._run_blocking(self._prepare_image, image_path)
             
-            # Load and prepare image
-            image = Image.open(image_path)
+            # Keep the encoded image for a possible re-analysis of this upload
+            image_part = {'mime_type': prepared['mime_type'], 'data': prepared['data']}
+            self.image_sessions.put(image_path, image_part)
             
-            # Optimize image if too large
-            if image.size[0] > 2048 or image.size[1] > 2048:
-                image.thumbnail((2048, 2048), Image.Resampling.LANCZOS)
+            # Same (or near-identical) photo analysed before: reuse that result
+            cached_result = self.result_cache.get(image_hash)
+            if cached_result is not None:
+                logging.info(f"Gemini result cache hit for {image_path} (hash {image_hash:016x})")
+                return self._replay_ingredients(cached_result, on_ingredient)
             
-            logging.info(f"Sending image to Gemini API: {image_path}")
+            logging.info(f"Sending image to Gemini API: {image_path} ({prepared['processed_bytes']} bytes, "
+                         f"{prepared['bytes_saved']} saved in {prepared['elapsed_ms']}ms)")
             
-            # Generate analysis
-            response = self.model.generate_content([
-                self.analysis_prompt,
-                image
-            ])
+            if self.file_upload:
+                image_part = await self._upload_image(image_path, image_part)
             
-            logging.info(f"Gemini response received: {response.text[:200]}...")
+            # Generate analysis from the pre-encoded bytes so the SDK does not re-encode
+            contents = [self._prompt(), image_part]
+            if on_ingredient is not None and self.streaming:
+                response_text = await self._generate_streaming(contents, on_ingredient)
+            else:
+                response_text = (await self._generate(contents, structured=True)).text
+            
+            logging.info(f"Gemini response received: {response_text[:200]}...")
             
             # Parse JSON response
-            result = self._parse_gemini_response(response.text)
+            result = self._parse_gemini_response(response_text)
             
             # Validate and enhance result
             result = self._validate_analysis_result(result)
             
             logging.info(f"Analysis completed with confidence: {result.get('confidence_overall', 0)}")
+            
+            # Only cache structured answers, never parse fallbacks
+            if result.get('main_food') or result.get('ingredients'):
+                self.result_cache.set(image_hash, result)
             return result
             
         except Exception as e:
@@ -107,6 +205,284 @@ class GeminiService:
             # Return fallback response instead of failing completely
             return self._get_fallback_response(str(e))
     
+    async def analyze_food_images(self, image_paths: List[str]) -> List[Dict]:
+        """
+        Analyze several food images with as few Gemini calls as possible
+        
+        Images are preprocessed in parallel, cached results are reused, and
+        the rest are sent in groups of up to GEMINI_BATCH_MAX_IMAGES per
+        multi-image prompt. An image the batch answer does not cover is
+        retried on its own.
+        
+        Args:
+            image_paths: Paths to the uploaded images
+            
+        Returns:
+            One analysis result per image, in the same order
+        """
+        if self.model is None:
+            logging.info("Running in demo mode - returning sample data")
+            return [self._get_demo_response() for _ in image_paths]
+        
+        try:
+            prepared = await asyncio.gather(*(
+                self._run_blocking(self._prepare_image, image_path) for image_path in image_paths
+            ))
+        except Exception as e:
+            logging.error(f"Gemini batch preprocessing failed: {str(e)}")
+            return [self._get_fallback_response(str(e)) for _ in image_paths]
+        
+        results = [None] * len(image_paths)
+        misses = []
+        for index, (_, image_hash) in enumerate(prepared):
+            cached_result = self.result_cache.get(image_hash)
+            if cached_result is not None:
+                results[index] = cached_result
+            else:
+                misses.append(index)
+        
+        groups = [misses[i:i + self.batch_max_images] for i in range(0, len(misses), self.batch_max_images)]
+        group_results = await asyncio.gather(*(
+            self._analyze_image_group([prepared[index] for index in group]) for group in groups
+        ))
+        
+        uncovered = []
+        for group, analyses in zip(groups, group_results):
+            for index, result in zip(group, analyses):
+                if result is None:
+                    uncovered.append(index)
+                results[index] = result
+        
+        # Images the batch answers left out are retried alone, all in parallel
+        retried = await asyncio.gather(*(self.analyze_food_image(image_paths[index]) for index in uncovered))
+        for index, result in zip(uncovered, retried):
+            results[index] = result
+        
+        logging.info(f"Analyzed {len(image_paths)} images: {len(image_paths) - len(misses)} cached, "
+                     f"{len(misses)} in {len(groups)} Gemini calls")
+        return results
+    
+    async def _analyze_image_group(self, group) -> List[Optional[Dict]]:
+        """
+        Analyze prepared images in one Gemini call
+        
+        Returns:
+            Validated result per image, or None where the answer has no usable entry
+        """
+        batch = len(group) > 1
+        if not batch:
+            contents = [self._prompt()]
+        else:
+            contents = [
+                f"You will receive {len(group)} food images. Analyze EACH image separately using the "
+                f"instructions below and return one JSON object of the form "
+                f'{{"dishes": [...]}} with exactly {len(group)} entries, one per image, in the same '
+                f"order as the images.\n" + self._prompt()
+            ]
+        contents.extend({'mime_type': prepared['mime_type'], 'data': prepared['data']} for prepared, _ in group)
+        
+        try:
+            response = await self._generate(contents, structured=True, batch=batch)
+            parsed = self._parse_gemini_response(response.text)
+        except Exception as e:
+            logging.error(f"Gemini batch analysis failed: {str(e)}")
+            return [None] * len(group)
+        
+        dishes = [parsed] if not batch else parsed.get('dishes')
+        if not isinstance(dishes, list) or len(dishes) != len(group):
+            logging.warning(f"Gemini batch answer did not cover all {len(group)} images, retrying individually")
+            return [None] * len(group)
+        
+        results = []
+        for (_, image_hash), dish in zip(group, dishes):
+            if not isinstance(dish, dict):
+                results.append(None)
+                continue
+            result = self._validate_analysis_result(dish)
+            if result.get('main_food') or result.get('ingredients'):
+                self.result_cache.set(image_hash, result)
+            results.append(result)
+        return results
+    
+    async def _upload_image(self, image_path: str, image_part: Dict):
+        """
+        Upload an encoded image through the Gemini File API
+
+        Returns:
+            File reference (also stored for re-analysis), or the inline part
+            if the upload fails
+        """
+        try:
+            uploaded = await self._run_blocking(partial(
+                genai.upload_file, io.BytesIO(image_part['data']), mime_type=image_part['mime_type']
+            ))
+        except Exception as e:
+            logging.warning(f"Gemini file upload failed for {image_path}, sending inline: {e}")
+            self.image_sessions.count('upload_failures')
+            return image_part
+        
+        # Uploaded files expire on Gemini's side (48h); nothing to clean up here
+        self.image_sessions.count('file_uploads')
+        self.image_sessions.put(image_path, uploaded)
+        return uploaded
+    
+    async def _session_image(self, image_path: str):
+        """Image part stored for this upload, preprocessing the file again only on a miss"""
+        image_part = self.image_sessions.get(image_path)
+        if image_part is None:
+            prepared = await self._run_blocking(preprocess_image, image_path)
+            image_part = {'mime_type': prepared['mime_type'], 'data': prepared['data']}
+            self.image_sessions.put(image_path, image_part)
+        return image_part
+    
+    def _prepare_image(self, image_path: str):
+        """Preprocess the image and compute its perceptual hash (CPU-bound)"""
+        prepared = preprocess_image(image_path)
+        return prepared, compute_dhash(prepared['image'])
+    
+    async def _run_blocking(self, func, *args):
+        """Run CPU-bound or blocking work off the event loop thread"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+    
+    async def _generate(self, contents, structured: bool = False, batch: bool = False):
+        """
+        Call Gemini without blocking the event loop
+        
+        Uses the SDK's native async API where available, otherwise runs the
+        blocking call in the loop's executor.
+        
+        Args:
+            structured: Request the compact schema-constrained JSON output
+            batch: The prompt covers several images ({"dishes": [...]})
+        """
+        kwargs = self._generation_kwargs(batch) if structured else {}
+        kwargs.update(self._request_kwargs())
+        
+        async def call():
+            if hasattr(self.model, 'generate_content_async'):
+                return await self.model.generate_content_async(contents, **kwargs)
+            return await self._run_blocking(partial(self.model.generate_content, contents, **kwargs))
+        
+        return await self._resilient(call)
+    
+    def _request_kwargs(self) -> Dict:
+        if not _SDK_SUPPORTS_REQUEST_OPTIONS:
+            return {}
+        return {'request_options': {'timeout': self.call_timeout}}
+    
+    async def _resilient(self, call, can_retry: Optional[Callable[[], bool]] = None):
+        """
+        Run a Gemini call under the circuit breaker, deadline and retry policy
+        
+        Each attempt first takes a slot from the host-wide governor, then is
+        bounded by GEMINI_TIMEOUT (queueing for the slot does not count).
+        Timeouts, 429 and 5xx errors are retried up to GEMINI_MAX_RETRIES times
+        with exponential backoff and full jitter; only a call that finally
+        fails counts against the breaker. Request (4xx) and SDK errors, governor
+        timeouts and cancellation give the admission back without an outcome.
+        
+        Args:
+            call: Coroutine function performing one attempt
+            can_retry: Returns False once retrying is no longer safe (e.g.
+                streamed output was already handed out)
+            
+        Raises:
+            CircuitOpenError: The breaker is open; no call was made
+            GovernorTimeout: No call slot freed up in time
+        """
+        probe = self.breaker.allow()
+        settled = False
+        attempt = 0
+        try:
+            while True:
+                try:
+                    async with self.governor.slot():
+                        result = await asyncio.wait_for(call(), self.call_timeout)
+                except _RETRYABLE_ERRORS as e:
+                    if attempt >= self.max_retries or (can_retry is not None and not can_retry()):
+                        self.breaker.record_failure()
+                        settled = True
+                        raise
+                    delay = random.uniform(0, self.retry_backoff * 2 ** attempt)
+                    attempt += 1
+                    logging.warning(f"Gemini call failed ({type(e).__name__}: {e}), "
+                                    f"retry {attempt}/{self.max_retries} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+                except _OUTAGE_ERRORS:
+                    self.breaker.record_failure()
+                    settled = True
+                    raise
+                else:
+                    self.breaker.record_success()
+                    settled = True
+                    return result
+        finally:
+            if not settled:
+                # Governor timeouts, request errors and cancellation say nothing
+                # about Gemini's health; this also frees a half-open probe
+                self.breaker.release(probe)
+    
+    def _prompt(self) -> str:
+        return COMPACT_PROMPT if self.structured_output else self.analysis_prompt
+    
+    def _generation_kwargs(self, batch: bool = False) -> Dict:
+        """generation_config for the compact output mode (empty when disabled)"""
+        if not self.structured_output or not _SDK_SUPPORTS_JSON_MIME:
+            return {}
+        config = {'response_mime_type': 'application/json'}
+        if _SDK_SUPPORTS_SCHEMA:
+            config['response_schema'] = BATCH_SCHEMA if batch else DISH_SCHEMA
+        return {'generation_config': config}
+    
+    async def _generate_streaming(self, contents, on_ingredient: Callable[[Dict], None]) -> str:
+        """
+        Call Gemini with stream=True, handing each completed ingredient to
+        on_ingredient while the rest of the answer is still being generated
+        
+        Returns:
+            The full response text
+        """
+        kwargs = self._generation_kwargs()
+        kwargs.update(self._request_kwargs())
+        parser = None
+        
+        def dispatch(text):
+            for ingredient in parser.feed(text):
+                if isinstance(ingredient, dict):
+                    on_ingredient(expand_ingredient(ingredient))
+        
+        async def stream():
+            nonlocal parser
+            parser = StreamingArrayParser('i' if self.structured_output else 'ingredients')
+            if hasattr(self.model, 'generate_content_async'):
+                response = await self.model.generate_content_async(contents, stream=True, **kwargs)
+                async for chunk in response:
+                    dispatch(chunk.text)
+            else:
+                # Pull the blocking stream one chunk at a time off the loop thread
+                response = await self._run_blocking(
+                    partial(self.model.generate_content, contents, stream=True, **kwargs)
+                )
+                chunks = iter(response)
+                while True:
+                    chunk = await self._run_blocking(next, chunks, None)
+                    if chunk is None:
+                        break
+                    dispatch(chunk.text)
+        
+        # Once ingredients have been handed out a retry would repeat them
+        await self._resilient(stream, can_retry=lambda: parser is None or parser.elements == 0)
+        
+        logging.info(f"Streamed {parser.elements} ingredients ahead of the full Gemini response")
+        return parser.text
+    
+    def _replay_ingredients(self, result: Dict, on_ingredient: Optional[Callable[[Dict], None]]) -> Dict:
+        """Give on_ingredient every ingredient of a result that did not come from a stream"""
+        if on_ingredient is not None:
+            for ingredient in result.get('ingredients', []):
+                on_ingredient(ingredient)
+        return result
+    
     def _get_demo_response(self) -> Dict:
         """Return demo response when API key is not available"""
         return {
@@ -184,7 +560,8 @@ class GeminiService:
             Refined analysis result
         """
         try:
-            image = Image.open(image_path)
+            # Reuse the image sent by the first pass (bytes or file reference)
+            image_part = await self._session_image(image_path)
             
             refined_prompt = f"""
             Re-analyze this food image with focus on uncertain items. 
@@ -198,11 +575,10 @@ class GeminiService:
 
             Use the same JSON format as before.
             """
+            if self.structured_output:
+                refined_prompt += COMPACT_PROMPT
             
-            response = self.model.generate_content([
-                refined_prompt,
-                image
-            ])
+            response = await self._generate([refined_prompt, image_part], structured=True)
             
             result = self._parse_gemini_response(response.text)
             result = self._validate_analysis_result(result)
@@ -215,6 +591,15 @@ class GeminiService:
     
     def _parse_gemini_response(self, response_text: str) -> Dict:
         """Parse Gemini API response and extract JSON"""
+        if self.structured_output:
+            # JSON MIME type: the whole answer should be the document itself
+            try:
+                result = self._expand_compact(json.loads(response_text))
+                output_stats.record('structured')
+                return result
+            except (json.JSONDecodeError, TypeError):
+                pass
+        
         try:
             # Try to find JSON in the response
             start_idx = response_text.find('{')
@@ -222,16 +607,28 @@ class GeminiService:
             
             if start_idx != -1 and end_idx != -1:
                 json_str = response_text[start_idx:end_idx]
-                return json.loads(json_str)
+                result = self._expand_compact(json.loads(json_str))
+                output_stats.record('extracted')
+                return result
             else:
                 # Fallback: create structured response from text
                 return self._create_fallback_response(response_text)
                 
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, TypeError):
             return self._create_fallback_response(response_text)
     
+    def _expand_compact(self, parsed) -> Dict:
+        """Map short keys back to the regular result layout (no-op for long-form answers)"""
+        if not isinstance(parsed, dict):
+            raise TypeError(f"Expected a JSON object, got {type(parsed).__name__}")
+        if isinstance(parsed.get('dishes'), list):
+            parsed['dishes'] = [expand_dish(dish) for dish in parsed['dishes']]
+            return parsed
+        return expand_dish(parsed)
+    
     def _create_fallback_response(self, text: str) -> Dict:
         """Create fallback response when JSON parsing fails"""
+        output_stats.record('fallbacks')
         return {
             "analysis_status": "partial",
             "confidence_overall": 0.5,
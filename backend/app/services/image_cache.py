@@ -0,0 +1,128 @@
+# Perceptual-hash cache for Gemini image analysis results
+import os
+import copy
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from PIL import Image, ImageOps
+
+
+def compute_dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """
+    Compute a difference hash (dHash) of an image
+
+    The image is orientation-normalized, converted to grayscale and shrunk to
+    (hash_size + 1) x hash_size; each bit records whether a pixel is brighter
+    than its right-hand neighbour. Re-encoded, resized or slightly re-framed
+    shots of the same plate land within a few bits of each other.
+
+    Args:
+        image: PIL image
+        hash_size: Hash width/height in bits (64-bit hash for the default 8)
+
+    Returns:
+        Hash as an integer
+    """
+    normalized = ImageOps.exif_transpose(image).convert('L')
+    small = normalized.resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class PerceptualHashCache:
+    def __init__(self, max_entries: int = 512, threshold: int = 5):
+        """
+        Size-bounded LRU mapping image hashes to analysis results
+
+        Args:
+            max_entries: Maximum number of cached results
+            threshold: Largest Hamming distance still treated as the same image
+        """
+        self.max_entries = max(int(max_entries), 1)
+        self.threshold = max(int(threshold), 0)
+        self._entries = OrderedDict()  # hash -> result
+        self._lock = threading.Lock()
+
+        self._stats = {
+            'hits': 0,
+            'exact_hits': 0,
+            'near_hits': 0,
+            'misses': 0,
+            'evictions': 0
+        }
+
+    def _find(self, image_hash: int) -> Optional[Tuple[int, int]]:
+        if image_hash in self._entries:
+            return image_hash, 0
+
+        best = None
+        for cached_hash in self._entries:
+            distance = hamming_distance(image_hash, cached_hash)
+            if distance <= self.threshold and (best is None or distance < best[1]):
+                best = (cached_hash, distance)
+        return best
+
+    def get(self, image_hash: int) -> Optional[Dict]:
+        """Return a copy of the closest cached result within the threshold"""
+        with self._lock:
+            match = self._find(image_hash)
+            if match is None:
+                self._stats['misses'] += 1
+                return None
+
+            cached_hash, distance = match
+            self._entries.move_to_end(cached_hash)
+            self._stats['hits'] += 1
+            self._stats['exact_hits' if distance == 0 else 'near_hits'] += 1
+            return copy.deepcopy(self._entries[cached_hash])
+
+    def set(self, image_hash: int, result: Dict):
+        with self._lock:
+            self._entries[image_hash] = copy.deepcopy(result)
+            self._entries.move_to_end(image_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                **self._stats,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'hit_rate': round(self._stats['hits'] / lookups, 4) if lookups else 0.0
+            }
+
+
+_image_cache: Optional[PerceptualHashCache] = None
+_image_cache_lock = threading.Lock()
+
+
+def get_gemini_image_cache() -> PerceptualHashCache:
+    """Return the process-wide Gemini result cache, configured from the environment"""
+    global _image_cache
+
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                _image_cache = PerceptualHashCache(
+                    max_entries=int(os.getenv('GEMINI_IMAGE_CACHE_SIZE', 512)),
+                    threshold=int(os.getenv('GEMINI_IMAGE_CACHE_THRESHOLD', 5))
+                )
+    return _image_cache
@@ -0,0 +1,92 @@
+# Per-upload Gemini image parts, reused by follow-up prompts
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class ImageSessionStore:
+    def __init__(self, max_entries: int = 32, ttl: float = 600.0):
+        """
+        Size- and age-bounded LRU of the image part sent for each upload
+
+        analyze_food_image stores the preprocessed image (inline bytes, or a
+        Gemini file reference when file upload is enabled) under the upload's
+        path; reanalyze_with_context picks it up instead of reading, decoding
+        and re-encoding the file again.
+
+        Args:
+            max_entries: Maximum number of uploads kept
+            ttl: Seconds an entry stays usable (bounds deferred re-analysis)
+        """
+        self.max_entries = max(int(max_entries), 1)
+        self.ttl = float(ttl)
+        self._entries = OrderedDict()  # image path -> (stored_at, part)
+        self._lock = threading.Lock()
+
+        self._stats = {
+            'stored': 0,
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'file_uploads': 0,
+            'upload_failures': 0
+        }
+
+    def put(self, image_path: str, part):
+        with self._lock:
+            self._entries[image_path] = (time.monotonic(), part)
+            self._entries.move_to_end(image_path)
+            self._stats['stored'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def get(self, image_path: str):
+        """Return the stored part for an upload, or None if absent or expired"""
+        with self._lock:
+            entry = self._entries.get(image_path)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[image_path]
+                self._stats['evictions'] += 1
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(image_path)
+            self._stats['hits'] += 1
+            return entry[1]
+
+    def count(self, outcome: str):
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                **self._stats,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hit_rate': round(self._stats['hits'] / lookups, 4) if lookups else 0.0
+            }
+
+
+_store: Optional[ImageSessionStore] = None
+_store_lock = threading.Lock()
+
+
+def get_image_session_store() -> ImageSessionStore:
+    """Return the process-wide image session store, configured from the environment"""
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ImageSessionStore(
+                    max_entries=int(os.getenv('GEMINI_IMAGE_SESSIONS', 32)),
+                    ttl=float(os.getenv('GEMINI_IMAGE_SESSION_TTL', 600))
+                )
+    return _store
@@ -0,0 +1,265 @@
+# Canonical ingredient names before USDA enrichment
+import os
+import re
+import difflib
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .food_matching import tokenize
+
+# Indonesian/English keyword pairs from category_keywords in database/schema.sql
+# (rows of one category with equal weight, listed one after the other)
+CATEGORY_KEYWORD_PAIRS = [
+    ('buah', 'fruit'), ('apel', 'apple'), ('pisang', 'banana'), ('jeruk', 'orange'), ('mangga', 'mango'),
+    ('segar', 'fresh'),
+    ('sayur', 'vegetable'), ('brokoli', 'broccoli'), ('bayam', 'spinach'), ('wortel', 'carrot'),
+    ('tomat', 'tomato'), ('hijau', 'green'),
+    ('nasi', 'rice'), ('roti', 'bread'), ('mie', 'noodle'), ('pasta', 'pasta'), ('gandum', 'wheat'),
+    ('sereal', 'cereal'),
+    ('daging', 'meat'), ('ayam', 'chicken'), ('sapi', 'beef'), ('ikan', 'fish'), ('telur', 'egg'),
+    ('tahu', 'tofu'), ('tempe', 'tempeh'),
+    ('kentang goreng', 'french fries'), ('cepat saji', 'fast food'), ('restoran', 'restaurant')
+]
+
+# Surface forms Gemini commonly returns, mapped to the name USDA matches best
+COMMON_ALIASES = {
+    'nasi': 'white rice',
+    'nasi putih': 'white rice',
+    'rice': 'white rice',
+    'steamed rice': 'white rice',
+    'plain rice': 'white rice',
+    'cooked rice': 'white rice',
+    'nasi merah': 'brown rice',
+    'telur': 'egg',
+    'telur ayam': 'egg',
+    'telur dadar': 'omelet',
+    'telur mata sapi': 'fried egg',
+    'ayam': 'chicken',
+    'daging ayam': 'chicken',
+    'daging sapi': 'beef',
+    'kangkung': 'water spinach',
+    'kol': 'cabbage',
+    'kubis': 'cabbage',
+    'timun': 'cucumber',
+    'mentimun': 'cucumber',
+    'bawang merah': 'shallot',
+    'bawang putih': 'garlic',
+    'bawang bombay': 'onion',
+    'cabai': 'chili pepper',
+    'cabe': 'chili pepper',
+    'kacang tanah': 'peanut',
+    'kacang panjang': 'yardlong bean',
+    'tauge': 'bean sprouts',
+    'kecap manis': 'sweet soy sauce',
+    'kecap': 'soy sauce',
+    'santan': 'coconut milk',
+    'kelapa': 'coconut',
+    'udang': 'shrimp',
+    'cumi': 'squid',
+    'kentang': 'potato',
+    'jagung': 'corn',
+    'ubi': 'sweet potato',
+    'singkong': 'cassava',
+    'keju': 'cheese',
+    'susu': 'milk',
+    'gula': 'sugar',
+    'garam': 'salt',
+    'minyak goreng': 'vegetable oil',
+    'kerupuk': 'shrimp chips',
+    'nasi goreng': 'fried rice',
+    'ayam goreng': 'fried chicken',
+    'mie goreng': 'fried noodles',
+    'bihun': 'rice noodles'
+}
+
+# Single words translated inside longer names ("ayam bakar" -> "chicken grilled")
+WORD_ALIASES = {
+    'goreng': 'fried',
+    'rebus': 'boiled',
+    'bakar': 'grilled',
+    'panggang': 'roasted',
+    'kukus': 'steamed',
+    'tumis': 'sauteed',
+    'putih': 'white',
+    'merah': 'red',
+    'manis': 'sweet',
+    'asin': 'salted',
+    'pedas': 'spicy',
+    'iris': 'sliced',
+    'potong': 'pieces'
+}
+
+_FUZZY_MIN_LENGTH = 5  # shorter names are matched exactly or not at all
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return ' '.join(re.sub(r'[^\w\s-]', ' ', str(name).lower()).replace('_', ' ').split())
+
+
+class IngredientResolver:
+    def __init__(self, aliases: Dict[str, str], word_aliases: Optional[Dict[str, str]] = None,
+                 fuzzy_cutoff: float = 0.85):
+        """
+        Map the surface forms of an ingredient name to one canonical name
+
+        Resolution stops at the first step that applies: exact alias,
+        stemmed alias (plural folding), word-by-word translation, then a
+        fuzzy match against the known names for misspellings. Unknown
+        names are only normalized.
+
+        Args:
+            aliases: Normalized surface form -> canonical name
+            word_aliases: Single-word translations used inside longer names
+                (Indonesian -> English only, so English names are never rewritten)
+            fuzzy_cutoff: Minimum difflib similarity for a fuzzy match
+        """
+        self.aliases = {normalize_name(alias): canonical for alias, canonical in aliases.items()}
+        # Canonical names resolve to themselves, so their variants find them too
+        for canonical in list(self.aliases.values()):
+            self.aliases.setdefault(normalize_name(canonical), canonical)
+        self.word_aliases = {normalize_name(word): canonical for word, canonical in (word_aliases or {}).items()}
+        self.stemmed = {}
+        for alias, canonical in self.aliases.items():
+            self.stemmed.setdefault(' '.join(tokenize(alias)), canonical)
+        self.fuzzy_cutoff = float(fuzzy_cutoff)
+        self._known = list(self.aliases)
+        self._memo: Dict[str, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+        self._stats = {
+            'resolved': 0,
+            'exact': 0,
+            'stemmed': 0,
+            'translated': 0,
+            'fuzzy': 0,
+            'unchanged': 0
+        }
+
+    def resolve(self, name: str) -> str:
+        """
+        Canonical name for an ingredient as Gemini named it
+
+        >>> resolver = IngredientResolver(dict(CATEGORY_KEYWORD_PAIRS, **COMMON_ALIASES), WORD_ALIASES)
+        >>> [resolver.resolve(name) for name in ('Nasi Putih', 'steamed rice', 'Eggs', 'brocoli')]
+        ['white rice', 'white rice', 'egg', 'broccoli']
+        >>> [resolver.resolve(name) for name in ('ice', 'mice', 'iced tea', 'nassi', 'rice cake')]
+        ['ice', 'mice', 'iced tea', 'nassi', 'rice cake']
+        """
+        key = normalize_name(name)
+        with self._lock:
+            memo = self._memo.get(key)
+        if memo is None:
+            memo = self._resolve(key)
+            with self._lock:
+                if len(self._memo) >= 10000:
+                    self._memo.clear()
+                self._memo[key] = memo
+        canonical, method = memo
+        with self._lock:
+            self._stats['resolved'] += 1
+            self._stats[method] += 1
+        return canonical
+
+    def _resolve(self, key: str) -> Tuple[str, str]:
+        if not key:
+            return key, 'unchanged'
+        if key in self.aliases:
+            return self.aliases[key], 'exact'
+
+        stemmed = ' '.join(tokenize(key))
+        if stemmed in self.stemmed:
+            return self.stemmed[stemmed], 'stemmed'
+
+        words = key.split()
+        if len(words) > 1:
+            translated = [self.word_aliases.get(word) or self.word_aliases.get(' '.join(tokenize(word)), word)
+                          for word in words]
+            if translated != words:
+                return ' '.join(translated), 'translated'
+
+        # Misspellings only: short names ('ice' vs 'rice') are too close to
+        # unrelated aliases, and a match may not add words ('nasi' -> 'white rice')
+        if len(key) >= _FUZZY_MIN_LENGTH:
+            candidates = [alias for alias in self._known if alias[0] == key[0]]
+            for close in difflib.get_close_matches(key, candidates, n=3, cutoff=self.fuzzy_cutoff):
+                canonical = self.aliases[close]
+                if len(canonical.split()) <= len(words):
+                    return canonical, 'fuzzy'
+        return key, 'unchanged'
+
+    def stats(self) -> Dict:
+        with self._lock:
+            resolved = self._stats['resolved']
+            return {
+                **self._stats,
+                'aliases': len(self.aliases),
+                'rewrite_rate': round(1 - self._stats['unchanged'] / resolved, 4) if resolved else 0.0
+            }
+
+
+def pair_category_keywords(rows: Iterable[Dict]) -> List[Tuple[str, str]]:
+    """
+    (Indonesian, English) pairs from category_keywords rows in id order
+
+    Pairs are neighbouring rows of the same category and weight in
+    different languages, which is how schema.sql seeds them.
+    """
+    rows = list(rows)
+    pairs = []
+    index = 0
+    while index < len(rows) - 1:
+        current, following = rows[index], rows[index + 1]
+        if (current['category_id'] == following['category_id'] and current['weight'] == following['weight']
+                and {current['language'], following['language']} == {'id', 'en'}):
+            indonesian, english = (current, following) if current['language'] == 'id' else (following, current)
+            pairs.append((indonesian['keyword'], english['keyword']))
+            index += 2
+        else:
+            index += 1
+    return pairs
+
+
+def _load_database_pairs() -> List[Tuple[str, str]]:
+    """Keyword pairs added to category_keywords beyond the schema seed (empty if unreachable)"""
+    from ..database import get_db_connection
+
+    conn = get_db_connection()
+    if not conn:
+        return []
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT category_id, keyword, weight, language FROM category_keywords ORDER BY id")
+        return pair_category_keywords(cursor.fetchall())
+    except Exception as e:
+        logging.warning(f"Could not load category_keywords aliases: {e}")
+        return []
+    finally:
+        cursor.close()
+        conn.close()
+
+
+_resolver: Optional[IngredientResolver] = None
+_resolver_lock = threading.Lock()
+
+
+def get_ingredient_resolver() -> IngredientResolver:
+    """Return the process-wide resolver (schema seed + category_keywords rows + common aliases)"""
+    global _resolver
+
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                pairs = list(CATEGORY_KEYWORD_PAIRS)
+                if os.getenv('INGREDIENT_ALIASES_FROM_DB', 'true').lower() in ('1', 'true', 'yes'):
+                    pairs.extend(_load_database_pairs())
+                aliases = dict(pairs)
+                aliases.update(COMMON_ALIASES)
+                words = {indonesian: english for indonesian, english in pairs if ' ' not in indonesian}
+                words.update(WORD_ALIASES)
+                _resolver = IngredientResolver(
+                    aliases, words,
+                    fuzzy_cutoff=float(os.getenv('INGREDIENT_FUZZY_CUTOFF', 0.85))
+                )
+    return _resolver
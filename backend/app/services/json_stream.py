@@ -0,0 +1,97 @@
+# Incremental JSON scanning for streamed Gemini responses
+import json
+import logging
+import re
+from typing import Dict, List
+
+_KEY_BEFORE_VALUE = r'"{}"\s*:\s*$'
+
+
+class StreamingArrayParser:
+    def __init__(self, array_key: str = 'ingredients'):
+        """
+        Pull completed elements out of a JSON array while the document streams in
+
+        Only the top-level object's `array_key` array is tracked: every time one
+        of its object elements is closed, the element is decoded and returned
+        from feed(). Text before the first '{' (e.g. a ```json fence) is
+        ignored, and the complete text is kept in `text` for the usual full
+        parse once the stream ends.
+
+        Args:
+            array_key: Key of the array inside the top-level object
+        """
+        self.array_key = array_key
+        self._key_pattern = re.compile(_KEY_BEFORE_VALUE.format(re.escape(array_key)))
+        self.text = ''
+        self._position = 0
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._array_depth = None  # stack depth inside the tracked array
+        self._element_start = None
+        self.elements = 0
+
+    def feed(self, chunk: str) -> List[Dict]:
+        """
+        Consume the next chunk of the response
+
+        Returns:
+            Array elements completed by this chunk, in document order
+        """
+        self.text += chunk
+        text = self.text
+        completed = []
+
+        for index in range(self._position, len(text)):
+            char = text[index]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if not self._stack:
+                # Outside the document (preamble or trailing text)
+                if char == '{':
+                    self._stack.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                if (char == '[' and self._array_depth is None and self._stack == ['{']
+                        and self._key_pattern.search(text, 0, index)):
+                    self._array_depth = len(self._stack) + 1
+                elif (char == '{' and self._array_depth is not None
+                        and len(self._stack) == self._array_depth):
+                    self._element_start = index
+                self._stack.append(char)
+            elif char in '}]':
+                self._stack.pop()
+                if self._array_depth is None:
+                    continue
+                if char == '}' and self._element_start is not None and len(self._stack) == self._array_depth:
+                    element = self._decode(text[self._element_start:index + 1])
+                    if element is not None:
+                        completed.append(element)
+                    self._element_start = None
+                elif char == ']' and len(self._stack) == self._array_depth - 1:
+                    # Array closed: later arrays with the same key are not tracked
+                    self._array_depth = -1
+
+        self._position = len(text)
+        return completed
+
+    def _decode(self, fragment: str):
+        try:
+            element = json.loads(fragment)
+        except ValueError as e:
+            logging.debug(f"Skipping undecodable streamed {self.array_key} element: {e}")
+            return None
+        self.elements += 1
+        return element
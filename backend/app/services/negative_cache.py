@@ -0,0 +1,203 @@
+# Negative cache for ingredient names USDA cannot resolve
+import os
+import math
+import time
+import struct
+import hashlib
+import logging
+import threading
+from typing import Dict, Optional
+
+from .usda_cache import LRUCache, SQLiteCacheStore, normalize_query
+
+_BLOOM_MAGIC = b'BLOOM001'
+_BLOOM_HEADER = struct.Struct('<8sII')  # magic, bit count, hash count
+
+
+class BloomFilter:
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.01):
+        """
+        Fixed-size Bloom filter over strings
+
+        Sized for `capacity` items at `error_rate` false positives; it never
+        gives false negatives, so a "no" needs no further checks.
+
+        Args:
+            capacity: Expected number of distinct items
+            error_rate: Target false-positive probability at capacity
+        """
+        capacity = max(int(capacity), 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 64)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first, second = struct.unpack('<QQ', digest)
+        # Double hashing: k positions from two independent 64-bit hashes
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def merge(self, other_bits: bytes):
+        """OR another filter of the same geometry into this one"""
+        merged = int.from_bytes(self.bits, 'little') | int.from_bytes(other_bits, 'little')
+        self.bits = bytearray(merged.to_bytes(len(self.bits), 'little'))
+
+    def read(self, path: str) -> Optional[bytes]:
+        """Bits of a filter saved at `path`, if it exists and has the same geometry"""
+        try:
+            with open(path, 'rb') as handle:
+                data = handle.read()
+        except FileNotFoundError:
+            return None
+        magic, size, hashes = _BLOOM_HEADER.unpack_from(data, 0)
+        if magic != _BLOOM_MAGIC or size != self.size or hashes != self.hashes:
+            logging.warning(f"Ignoring Bloom filter {path} with a different geometry")
+            return None
+        return data[_BLOOM_HEADER.size:]
+
+    def save(self, path: str, bits: Optional[bytes] = None):
+        """Write the filter (or a snapshot of its `bits`) to `path`"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, 'wb') as handle:
+            handle.write(_BLOOM_HEADER.pack(_BLOOM_MAGIC, self.size, self.hashes))
+            handle.write(self.bits if bits is None else bits)
+        os.replace(temporary, path)
+
+
+class NegativeLookupCache:
+    def __init__(self, filter_: BloomFilter, memory: LRUCache, store: Optional[SQLiteCacheStore] = None,
+                 bloom_path: Optional[str] = None, sync_interval: float = 60.0):
+        """
+        Remember queries USDA returned no foods for, for a limited time
+
+        A Bloom filter answers "never missed" without touching the TTL entries,
+        so lookups for ordinary names pay nothing. A filter hit is confirmed
+        against the memory LRU and then the shared SQLite table, which hold the
+        expiry. The filter is saved to `bloom_path` and merged with the copy
+        other workers saved there every `sync_interval` seconds.
+
+        Args:
+            filter_: Bloom filter in front of the entries
+            memory: In-process TTL entries
+            store: Optional TTL entries shared by all workers
+            bloom_path: File the filter is persisted to and shared through
+            sync_interval: Seconds between filter merges with the file
+        """
+        self.filter = filter_
+        self.memory = memory
+        self.store = store
+        self.bloom_path = bloom_path
+        self.sync_interval = float(sync_interval)
+        self._lock = threading.Lock()
+        self._synced_at = 0.0
+
+        self._stats = {
+            'checks': 0,
+            'filter_rejects': 0,
+            'hits': 0,
+            'false_positives': 0,
+            'added': 0
+        }
+        self._sync(force=True)
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def _sync(self, force: bool = False):
+        if not self.bloom_path:
+            return
+        with self._lock:
+            if not force and time.monotonic() - self._synced_at < self.sync_interval:
+                return
+            self._synced_at = time.monotonic()  # claims this round; other threads skip it
+
+        # File I/O runs outside the lock so concurrent lookups never wait on disk;
+        # only the in-memory merge and the snapshot for saving hold it
+        try:
+            saved = self.filter.read(self.bloom_path)
+            with self._lock:
+                if saved is not None:
+                    self.filter.merge(saved)
+                snapshot = bytes(self.filter.bits)
+            self.filter.save(self.bloom_path, snapshot)
+        except (OSError, struct.error) as e:
+            logging.warning(f"USDA negative cache filter sync failed: {e}")
+
+    def contains(self, query: str) -> bool:
+        """True if this query recently returned no USDA foods"""
+        key = normalize_query(query)
+        self._count('checks')
+        self._sync()
+        if key not in self.filter:
+            self._count('filter_rejects')
+            return False
+
+        if self.memory.get(key) is None:
+            if self.store is None or self.store.get(key) is None:
+                self._count('false_positives')  # filter collision or expired entry
+                return False
+            self.memory.set(key, True)
+        self._count('hits')
+        return True
+
+    def add(self, query: str):
+        key = normalize_query(query)
+        with self._lock:
+            self.filter.add(key)  # not concurrently with a merge replacing the bits
+        self.memory.set(key, True)
+        if self.store is not None:
+            self.store.set(key, {'miss': True})
+        self._count('added')
+        self._sync()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            checks = self._stats['checks']
+            return {
+                **self._stats,
+                'hit_rate': round(self._stats['hits'] / checks, 4) if checks else 0.0,
+                'filter_bits': self.filter.size,
+                'filter_hashes': self.filter.hashes,
+                'filter_path': self.bloom_path,
+                'memory': self.memory.stats(),
+                'persistent': self.store.stats() if self.store is not None else None
+            }
+
+
+_negative_cache: Optional[NegativeLookupCache] = None
+_negative_cache_lock = threading.Lock()
+
+
+def get_usda_negative_cache() -> NegativeLookupCache:
+    """Return the process-wide USDA negative cache, configured from the environment"""
+    global _negative_cache
+
+    if _negative_cache is None:
+        with _negative_cache_lock:
+            if _negative_cache is None:
+                ttl = float(os.getenv('USDA_NEGATIVE_TTL', 86400))
+                store = None
+                cache_path = os.getenv('USDA_CACHE_DB', os.path.join('cache', 'usda_cache.sqlite3'))
+                if cache_path:
+                    store = SQLiteCacheStore(cache_path, ttl=ttl, table='usda_negative_cache')
+                _negative_cache = NegativeLookupCache(
+                    BloomFilter(
+                        capacity=int(os.getenv('USDA_NEGATIVE_CAPACITY', 100000)),
+                        error_rate=float(os.getenv('USDA_NEGATIVE_ERROR_RATE', 0.01))
+                    ),
+                    LRUCache(max_size=int(os.getenv('USDA_CACHE_SIZE', 2048)), ttl=ttl),
+                    store=store,
+                    bloom_path=os.getenv('USDA_NEGATIVE_BLOOM', os.path.join('cache', 'usda_negative.bloom'))
+                )
+    return _negative_cache
@@ -0,0 +1,219 @@
+# Memory-mapped nutrient table compiled from the offline USDA store
+import os
+import json
+import mmap
+import struct
+import bisect
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from .usda_cache import normalize_query
+from .usda_offline import DATA_TYPES, NUTRIENT_FIELDS
+
+MAGIC = b'NUTRTAB1'
+_HEADER = struct.Struct('<8sIIII')  # magic, rows, nutrients per row, strings blob size, reserved
+_DATA_TYPE_NAMES = list(DATA_TYPES.values())
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _layout(rows: int, nutrients: int, description_bytes: int, key_bytes: int, strings_bytes: int) -> Dict:
+    """Byte offsets of every section; shared by the writer and the reader"""
+    sections = [
+        ('ids', 4 * rows),                    # uint32 fdcId, ascending
+        ('data_types', rows),                 # uint8 index into _DATA_TYPE_NAMES
+        ('categories', 2 * rows),             # uint16 index into the strings blob
+        ('nutrients', 4 * rows * nutrients),  # float32 row-major, NaN = not reported
+        ('description_offsets', 4 * (rows + 1)),
+        ('descriptions', description_bytes),
+        ('key_offsets', 4 * (rows + 1)),      # sorted normalized descriptions...
+        ('key_rows', 4 * rows),               # ...and the row each one belongs to
+        ('keys', key_bytes),
+        ('strings', strings_bytes)            # JSON list of category names
+    ]
+    layout = {}
+    offset = _align(_HEADER.size + 4 * 3)  # header + description/key blob sizes + padding
+    for name, size in sections:
+        layout[name] = (offset, size)
+        offset = _align(offset + size)
+    layout['size'] = offset
+    return layout
+
+
+def compile_nutrient_table(db_path: str, table_path: str) -> Dict:
+    """
+    Compile the offline SQLite store into a fixed-width binary nutrient table
+
+    Args:
+        db_path: Store written by usda_offline.import_fdc_dataset
+        table_path: Binary file to create (swapped in with a rename)
+
+    Returns:
+        Row count and file size
+    """
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            f"SELECT fdc_id, description, data_type, category, {', '.join(NUTRIENT_FIELDS)} "
+            f"FROM foods ORDER BY fdc_id"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    categories = sorted({row[3] or '' for row in rows})
+    category_index = {name: index for index, name in enumerate(categories)}
+    strings = json.dumps(categories).encode('utf-8')
+
+    descriptions = [row[1].encode('utf-8') for row in rows]
+    keys = sorted((normalize_query(row[1]).encode('utf-8'), index) for index, row in enumerate(rows))
+    description_bytes = sum(len(value) for value in descriptions)
+    key_bytes = sum(len(key) for key, _ in keys)
+
+    count, width = len(rows), len(NUTRIENT_FIELDS)
+    layout = _layout(count, width, description_bytes, key_bytes, len(strings))
+    buffer = bytearray(layout['size'])
+    _HEADER.pack_into(buffer, 0, MAGIC, count, width, len(strings), 0)
+    struct.pack_into('<II', buffer, _HEADER.size, description_bytes, key_bytes)
+
+    def put(section, fmt, values):
+        struct.pack_into(f'<{len(values)}{fmt}', buffer, layout[section][0], *values)
+
+    def put_blob(section, offsets_section, blobs):
+        offsets, position = [0], layout[section][0]
+        for blob in blobs:
+            buffer[position:position + len(blob)] = blob
+            position += len(blob)
+            offsets.append(offsets[-1] + len(blob))
+        put(offsets_section, 'I', offsets)
+
+    put('ids', 'I', [row[0] for row in rows])
+    put('data_types', 'B', [_DATA_TYPE_NAMES.index(row[2]) for row in rows])
+    put('categories', 'H', [category_index[row[3] or ''] for row in rows])
+    put('nutrients', 'f', [float('nan') if value is None else value for row in rows for value in row[4:]])
+    put_blob('descriptions', 'description_offsets', descriptions)
+    put_blob('keys', 'key_offsets', [key for key, _ in keys])
+    put('key_rows', 'I', [index for _, index in keys])
+    start = layout['strings'][0]
+    buffer[start:start + len(strings)] = strings
+
+    building = f"{table_path}.building"
+    with open(building, 'wb') as handle:
+        handle.write(buffer)
+    os.replace(building, table_path)
+    return {'rows': count, 'bytes': layout['size'], 'path': table_path}
+
+
+class NutrientTable:
+    def __init__(self, path: str):
+        """
+        Read-only view of a compiled nutrient table
+
+        The file is mmap'ed and every section is a memoryview over the
+        mapping, so all workers share one page-cache copy, opening it costs
+        no parsing, and lookups read values in place.
+
+        Args:
+            path: File written by compile_nutrient_table
+        """
+        self.path = path
+        with open(path, 'rb') as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.rows, width, strings_bytes, _ = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or width != len(NUTRIENT_FIELDS):
+            raise ValueError(f"{path} is not a compatible nutrient table")
+        description_bytes, key_bytes = struct.unpack_from('<II', self._map, _HEADER.size)
+        layout = _layout(self.rows, width, description_bytes, key_bytes, strings_bytes)
+
+        # Sections are written little-endian; the casts below read native order (x86/ARM hosts)
+        view = memoryview(self._map)
+
+        def section(name, fmt=None):
+            offset, size = layout[name]
+            part = view[offset:offset + size]
+            return part.cast(fmt) if fmt else part
+
+        self._ids = section('ids', 'I')
+        self._data_types = section('data_types', 'B')
+        self._categories = section('categories', 'H')
+        self._nutrients = section('nutrients', 'f')
+        self._description_offsets = section('description_offsets', 'I')
+        self._descriptions = section('descriptions')
+        self._key_offsets = section('key_offsets', 'I')
+        self._key_rows = section('key_rows', 'I')
+        self._keys = section('keys')
+        self._category_names = json.loads(bytes(section('strings')).decode('utf-8'))
+        self._width = width
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def row_of(self, fdc_id: int) -> Optional[int]:
+        """Row index of an FDC id (binary search over the id column)"""
+        row = bisect.bisect_left(self._ids, int(fdc_id))
+        return row if row < self.rows and self._ids[row] == int(fdc_id) else None
+
+    def nutrients(self, row: int) -> Dict:
+        start = row * self._width
+        values = self._nutrients[start:start + self._width]
+        # NaN (not reported) reads as 0, like a nutrient missing from an API answer
+        return {field: round(value, 4) if value == value else 0 for field, value in zip(NUTRIENT_FIELDS, values)}
+
+    def record(self, row: int) -> Dict:
+        """Row in the USDAService search result layout"""
+        start, end = self._description_offsets[row], self._description_offsets[row + 1]
+        return {
+            'usda_id': self._ids[row],
+            'name': bytes(self._descriptions[start:end]).decode('utf-8'),
+            'brand': '',
+            'category': self._category_names[self._categories[row]],
+            'data_type': _DATA_TYPE_NAMES[self._data_types[row]],
+            'nutrition': self.nutrients(row),
+            'source': 'offline'
+        }
+
+    def _key(self, position: int) -> bytes:
+        return bytes(self._keys[self._key_offsets[position]:self._key_offsets[position + 1]])
+
+    def find_name(self, name: str) -> List[int]:
+        """Rows whose normalized description equals `name` (binary search over the name index)"""
+        key = normalize_query(name).encode('utf-8')
+        low, high = 0, self.rows
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        rows = []
+        while low < self.rows and self._key(low) == key:
+            rows.append(self._key_rows[low])
+            low += 1
+        return rows
+
+    def close(self):
+        for name in ('_ids', '_data_types', '_categories', '_nutrients', '_description_offsets',
+                     '_descriptions', '_key_offsets', '_key_rows', '_keys'):
+            getattr(self, name).release()
+        self._map.close()
+
+
+_table: Optional[NutrientTable] = None
+_table_loaded = False
+_table_lock = threading.Lock()
+
+
+def get_nutrient_table() -> Optional[NutrientTable]:
+    """Return the process-wide mapping of USDA_NUTRIENT_TABLE, or None if it has not been compiled"""
+    global _table, _table_loaded
+
+    if not _table_loaded:
+        with _table_lock:
+            if not _table_loaded:
+                path = os.getenv('USDA_NUTRIENT_TABLE', os.path.join('data', 'usda_nutrients.bin'))
+                _table = NutrientTable(path) if os.path.exists(path) else None
+                _table_loaded = True
+    return _table
@@ -0,0 +1,108 @@
+# Token-bucket rate limiting for outbound API calls
+import os
+import time
+import asyncio
+import threading
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        """
+        Thread-safe token bucket that never sleeps while holding its lock
+
+        Callers reserve a token and get back how long they must wait before
+        using it, so the decision of how to wait (time.sleep, asyncio.sleep,
+        or giving up) stays with the caller.
+
+        Args:
+            rate: Tokens added per second
+            burst: Maximum tokens that can accumulate
+        """
+        self.rate = max(float(rate), 1e-6)
+        self.burst = max(float(burst), 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        self._stats = {
+            'acquired': 0,
+            'throttled': 0,
+            'denied': 0,
+            'throttled_seconds': 0.0
+        }
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, tokens: float = 1, max_wait: Optional[float] = None) -> Optional[float]:
+        """
+        Reserve tokens and return the delay before they may be used
+
+        Args:
+            tokens: Number of tokens to take
+            max_wait: Refuse (and reserve nothing) if the delay would exceed this
+
+        Returns:
+            Seconds to wait (0.0 when a token is available now), or None if refused
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            deficit = tokens - self._tokens
+            wait = deficit / self.rate if deficit > 0 else 0.0
+
+            if max_wait is not None and wait > max_wait:
+                self._stats['denied'] += 1
+                return None
+
+            # Going into debt queues later callers behind this reservation
+            self._tokens -= tokens
+            self._stats['acquired'] += 1
+            if wait > 0:
+                self._stats['throttled'] += 1
+                self._stats['throttled_seconds'] += wait
+            return wait
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Reserve tokens and block the calling thread until usable; returns seconds waited"""
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens: float = 1) -> float:
+        """Reserve tokens and suspend the coroutine until usable; returns seconds waited"""
+        wait = self.reserve(tokens)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._refill(time.monotonic())
+            return {
+                **self._stats,
+                'throttled_seconds': round(self._stats['throttled_seconds'], 3),
+                'rate_per_second': self.rate,
+                'burst': self.burst,
+                'available_tokens': round(self._tokens, 2)
+            }
+
+
+_usda_limiter: Optional[TokenBucket] = None
+_usda_limiter_lock = threading.Lock()
+
+
+def get_usda_rate_limiter() -> TokenBucket:
+    """Return the process-wide limiter shared by every USDA request"""
+    global _usda_limiter
+
+    if _usda_limiter is None:
+        with _usda_limiter_lock:
+            if _usda_limiter is None:
+                _usda_limiter = TokenBucket(
+                    rate=float(os.getenv('USDA_RATE_LIMIT', 10)),
+                    burst=int(os.getenv('USDA_RATE_BURST', 10))
+                )
+    return _usda_limiter
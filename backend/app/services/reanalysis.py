@@ -0,0 +1,261 @@
+# Deadline-aware Gemini re-analysis of low-confidence results
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class SpeculativeLookups:
+    def __init__(self, usda_service):
+        """
+        USDA lookups started on first-pass ingredient names
+
+        While a re-analysis is in flight these run on the enrichment pool;
+        names that survive re-analysis reuse them, and only new or renamed
+        ingredients need a lookup afterwards.
+
+        Args:
+            usda_service: Service providing prefetch_food
+        """
+        self.usda_service = usda_service
+        self.futures = {}   # name -> Future, usable as `pending` for search_foods_concurrently
+        self._timings = {}  # name -> [started, finished]
+        self._lock = threading.Lock()
+
+    def start(self, name: str):
+        """Start a lookup for name unless one is already running"""
+        with self._lock:
+            if name in self.futures:
+                return
+            self._timings[name] = [time.perf_counter(), None]
+            self.futures[name] = future = self.usda_service.prefetch_food(name)
+        future.add_done_callback(lambda _, timing=self._timings[name]: timing.__setitem__(1, time.perf_counter()))
+
+    def start_all(self, ingredients: Iterable[Dict]):
+        for ingredient in ingredients:
+            self.start(ingredient.get('name', 'Unknown'))
+
+    def overlap(self, names: Iterable[str], window_start: float, window_end: float) -> float:
+        """
+        Lookup time for `names` that ran inside the window (seconds)
+
+        Lookups run in parallel, so the latency taken off the critical path
+        is the longest single overlap, not the sum.
+        """
+        hidden = 0.0
+        with self._lock:
+            for name in names:
+                timing = self._timings.get(name)
+                if timing is None:
+                    continue
+                started, finished = timing
+                finished = window_end if finished is None else min(finished, window_end)
+                hidden = max(hidden, finished - max(started, window_start))
+        return hidden
+
+
+class ReanalysisPolicy:
+    def __init__(self, threshold: float = 0.7, deadline: float = 8.0, initial_estimate: float = 4.0):
+        """
+        Decide whether a low-confidence result is re-analysed inline or deferred
+
+        Inline re-analysis is only attempted when the first pass plus the
+        expected re-analysis time (a moving average of observed calls) fits
+        in `deadline`, and it is cut off when the deadline is reached. In
+        every other case the first-pass result is returned at once and the
+        re-analysis keeps running in the background.
+
+        Args:
+            threshold: Confidence below which a result is re-analysed
+            deadline: Seconds from upload the caller is willing to wait
+            initial_estimate: Expected re-analysis seconds before any are observed
+        """
+        self.threshold = float(threshold)
+        self.deadline = float(deadline)
+        self._estimate = float(initial_estimate)
+        self._lock = threading.Lock()
+
+        self._stats = {
+            'skipped': 0,
+            'inline': 0,
+            'deferred': 0,
+            'overran': 0,
+            'deferred_completed': 0,
+            'failed': 0,
+            'speculative_lookups': 0,
+            'speculative_reused': 0,
+            'speculative_wasted': 0,
+            'post_reanalysis_lookups': 0,
+            'reanalysis_seconds': 0.0,
+            'hidden_seconds': 0.0
+        }
+
+    def expected_seconds(self) -> float:
+        with self._lock:
+            return self._estimate
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self._stats[outcome] += 1
+
+    async def _timed(self, coro):
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._estimate = 0.8 * self._estimate + 0.2 * elapsed
+
+    def record_speculation(self, speculation: SpeculativeLookups, first_result: Dict, refined_result: Dict,
+                           window: Optional[Tuple[float, float]] = None):
+        """
+        Count how the speculative lookups played out for one re-analysis
+
+        Args:
+            window: (start, end) of an inline re-analysis, to measure hidden latency
+        """
+        first_names = {item.get('name', 'Unknown') for item in first_result.get('ingredients', [])}
+        refined_names = {item.get('name', 'Unknown') for item in refined_result.get('ingredients', [])}
+        reused = first_names & refined_names
+        hidden = speculation.overlap(reused, *window) if window else 0.0
+
+        with self._lock:
+            self._stats['speculative_lookups'] += len(first_names)
+            self._stats['speculative_reused'] += len(reused)
+            self._stats['speculative_wasted'] += len(first_names - refined_names)
+            self._stats['post_reanalysis_lookups'] += len(refined_names - first_names)
+            if window:
+                self._stats['reanalysis_seconds'] += window[1] - window[0]
+                self._stats['hidden_seconds'] += hidden
+
+        if window:
+            logging.info(f"Speculative USDA lookups: {len(reused)}/{len(first_names)} reused, "
+                         f"{hidden:.2f}s of {window[1] - window[0]:.2f}s re-analysis hidden")
+
+    async def refine(self, gemini_service, image_path: str, first_result: Dict, confidence: float,
+                     elapsed: float, speculation: Optional[SpeculativeLookups] = None) -> Tuple[Dict, Optional[Future]]:
+        """
+        Apply the policy to a first-pass Gemini result
+
+        Args:
+            gemini_service: Service providing reanalyze_with_context
+            image_path: Analysed image
+            first_result: First-pass analysis result
+            confidence: Confidence the threshold is compared against
+            elapsed: Seconds already spent on this analysis
+            speculation: If given, USDA lookups for the first-pass ingredients
+                are started before re-analysis so they overlap with it
+
+        Returns:
+            Tuple of (result to use now, deferred re-analysis or None). The
+            deferred value is a concurrent.futures.Future resolving to the
+            refined result, so it can be awaited or chained from any thread.
+        """
+        if confidence >= self.threshold:
+            self._count('skipped')
+            return first_result, None
+
+        if speculation is not None:
+            speculation.start_all(first_result.get('ingredients', []))
+
+        window_start = time.perf_counter()
+        task = asyncio.ensure_future(self._timed(gemini_service.reanalyze_with_context(image_path, first_result)))
+        remaining = self.deadline - elapsed
+
+        if remaining >= self.expected_seconds():
+            try:
+                # shield: on timeout the re-analysis carries on instead of being cancelled
+                refined = await asyncio.wait_for(asyncio.shield(task), remaining)
+                self._count('inline')
+                logging.info(f"Re-analysed {image_path} inline ({confidence:.2f} confidence)")
+                if speculation is not None:
+                    self.record_speculation(speculation, first_result, refined, (window_start, time.perf_counter()))
+                return refined, None
+            except asyncio.TimeoutError:
+                self._count('overran')
+                logging.info(f"Re-analysis of {image_path} overran its {remaining:.1f}s budget, deferring")
+            except Exception as e:
+                self._count('failed')
+                logging.error(f"Re-analysis of {image_path} failed: {e}")
+                return first_result, None
+        else:
+            logging.info(f"Deferring re-analysis of {image_path}: {remaining:.1f}s left, "
+                         f"~{self.expected_seconds():.1f}s needed")
+
+        self._count('deferred')
+        return first_result, self._relay(task, first_result, speculation)
+
+    def _relay(self, task: asyncio.Future, first_result: Dict,
+               speculation: Optional[SpeculativeLookups] = None) -> Future:
+        """Mirror an asyncio task into a thread-safe future"""
+        future = Future()
+
+        def done(finished):
+            if finished.cancelled():
+                future.cancel()
+            elif finished.exception() is not None:
+                self._count('failed')
+                future.set_exception(finished.exception())
+            else:
+                self._count('deferred_completed')
+                if speculation is not None:
+                    self.record_speculation(speculation, first_result, finished.result())
+                future.set_result(finished.result())
+
+        task.add_done_callback(done)
+        return future
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self._stats,
+                'reanalysis_seconds': round(self._stats['reanalysis_seconds'], 3),
+                'hidden_seconds': round(self._stats['hidden_seconds'], 3),
+                'hidden_fraction': round(
+                    self._stats['hidden_seconds'] / self._stats['reanalysis_seconds'], 4
+                ) if self._stats['reanalysis_seconds'] else 0.0,
+                'threshold': self.threshold,
+                'deadline_seconds': self.deadline,
+                'expected_seconds': round(self._estimate, 3)
+            }
+
+
+def pipeline_reanalysis_enabled() -> bool:
+    """
+    Whether the upload pipeline (/analyze, background jobs) re-analyses low-confidence results
+
+    Off unless REANALYSIS_IN_PIPELINE is set: each re-analysis is a second
+    Gemini call, and a deferred one rewrites the saved session afterwards.
+
+    >>> os.environ.pop('REANALYSIS_IN_PIPELINE', None) and None
+    >>> pipeline_reanalysis_enabled()
+    False
+    >>> os.environ['REANALYSIS_IN_PIPELINE'] = 'true'
+    >>> pipeline_reanalysis_enabled()
+    True
+    >>> del os.environ['REANALYSIS_IN_PIPELINE']
+    """
+    return os.getenv('REANALYSIS_IN_PIPELINE', 'false').lower() in ('1', 'true', 'yes')
+
+
+_policy: Optional[ReanalysisPolicy] = None
+_policy_lock = threading.Lock()
+
+
+def get_reanalysis_policy() -> ReanalysisPolicy:
+    """Return the process-wide re-analysis policy, configured from the environment"""
+    global _policy
+
+    if _policy is None:
+        with _policy_lock:
+            if _policy is None:
+                _policy = ReanalysisPolicy(
+                    threshold=float(os.getenv('REANALYSIS_THRESHOLD', 0.7)),
+                    deadline=float(os.getenv('REANALYSIS_DEADLINE', 8)),
+                    initial_estimate=float(os.getenv('REANALYSIS_ESTIMATE', 4))
+                )
+    return _policy
@@ -0,0 +1,253 @@
+# Two-tier cache for USDA FoodData Central lookups
+import os
+import json
+import copy
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a food search query so surface variations share one cache key"""
+    return ' '.join(str(query).strip().lower().split())
+
+
+class LRUCache:
+    def __init__(self, max_size: int = 2048, ttl: float = 86400):
+        """
+        Thread-safe in-process LRU cache with per-entry time-to-live
+
+        Args:
+            max_size: Maximum number of entries kept in memory
+            ttl: Seconds an entry stays valid
+        """
+        self.max_size = max(int(max_size), 1)
+        self.ttl = float(ttl)
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+class SQLiteCacheStore:
+    def __init__(self, path: str, ttl: float = 30 * 86400, table: str = 'usda_cache'):
+        """
+        Durable key/value store backed by a local SQLite file
+
+        SQLite (in WAL mode) is shared safely by every worker process on the
+        host, so a lookup paid for by one worker warms all of them and
+        survives restarts and deploys.
+
+        Args:
+            path: SQLite database file
+            ttl: Seconds a stored entry stays valid
+            table: Table holding the entries (several stores may share one file)
+        """
+        self.path = path
+        self.ttl = float(ttl)
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Reopen after fork: SQLite handles must not cross process boundaries
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    cache_key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+            """)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get(self, key: str) -> Optional[Dict]:
+        try:
+            with self._lock:
+                row = self._connection().execute(
+                    f"SELECT payload, stored_at FROM {self.table} WHERE cache_key = ?", (key,)
+                ).fetchone()
+                if row is None or row[1] + self.ttl < time.time():
+                    self.misses += 1
+                    return None
+                self.hits += 1
+                return json.loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            logging.warning(f"USDA cache read failed for '{key}': {e}")
+            self.errors += 1
+            return None
+
+    def set(self, key: str, value: Dict):
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (cache_key, payload, stored_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), time.time())
+                )
+                conn.commit()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logging.warning(f"USDA cache write failed for '{key}': {e}")
+            self.errors += 1
+
+    def purge_expired(self) -> int:
+        """Delete expired rows, returning how many were removed"""
+        try:
+            with self._lock:
+                conn = self._connection()
+                cursor = conn.execute(f"DELETE FROM {self.table} WHERE stored_at < ?", (time.time() - self.ttl,))
+                conn.commit()
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            logging.warning(f"USDA cache purge failed: {e}")
+            return 0
+
+    def stats(self) -> Dict:
+        return {
+            'path': self.path,
+            'table': self.table,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors
+        }
+
+
+class USDALookupCache:
+    def __init__(self, memory: LRUCache, store: Optional[SQLiteCacheStore] = None):
+        """
+        Memory LRU in front of an optional durable store
+
+        Args:
+            memory: First-tier in-process cache
+            store: Second-tier persistent cache (None disables it)
+        """
+        self.memory = memory
+        self.store = store
+
+    @staticmethod
+    def search_key(query: str) -> str:
+        return f"search:{normalize_query(query)}"
+
+    @staticmethod
+    def food_key(fdc_id) -> str:
+        return f"food:{int(fdc_id)}"
+
+    def get(self, key: str) -> Optional[Dict]:
+        value = self.memory.get(key)
+        if value is None and self.store is not None:
+            value = self.store.get(key)
+            if value is not None:
+                # Promote to memory so the next lookup skips SQLite too
+                self.memory.set(key, value)
+        # Callers may annotate the result, never hand out the cached object itself
+        return copy.deepcopy(value) if value is not None else None
+
+    def set(self, key: str, value: Dict):
+        value = copy.deepcopy(value)
+        self.memory.set(key, value)
+        if self.store is not None:
+            self.store.set(key, value)
+
+    def clear(self):
+        self.memory.clear()
+
+    def stats(self) -> Dict:
+        memory = self.memory.stats()
+        store = self.store.stats() if self.store is not None else None
+        hits = memory['hits'] + (store['hits'] if store else 0)
+        lookups = memory['hits'] + memory['misses']
+        return {
+            'memory': memory,
+            'persistent': store,
+            'hits': hits,
+            'misses': store['misses'] if store else memory['misses'],
+            'evictions': memory['evictions'],
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0
+        }
+
+
+_cache: Optional[USDALookupCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_usda_cache() -> USDALookupCache:
+    """Return the process-wide USDA lookup cache, configured from the environment"""
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                memory = LRUCache(
+                    max_size=int(os.getenv('USDA_CACHE_SIZE', 2048)),
+                    ttl=float(os.getenv('USDA_CACHE_TTL', 86400))
+                )
+                store = None
+                cache_path = os.getenv('USDA_CACHE_DB', os.path.join('cache', 'usda_cache.sqlite3'))
+                if cache_path:
+                    store = SQLiteCacheStore(
+                        cache_path,
+                        ttl=float(os.getenv('USDA_CACHE_PERSIST_TTL', 30 * 86400))
+                    )
+                _cache = USDALookupCache(memory, store)
+    return _cache
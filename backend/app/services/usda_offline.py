@@ -0,0 +1,444 @@
+# Offline USDA FoodData Central store built from the bulk downloads
+import os
+import csv
+import io
+import json
+import time
+import sqlite3
+import logging
+import zipfile
+import argparse
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO
+
+from .food_matching import DATA_TYPE_PREFERENCE, score_candidate, tokenize
+
+# Result field -> legacy FDC nutrient number (the ids USDAService.nutrient_ids uses)
+NUTRIENT_NUMBERS = {
+    'calories': 208,
+    'protein': 203,
+    'fat': 204,
+    'carbs': 205,
+    'fiber': 291,
+    'sugar': 269,
+    'sodium': 307,
+    'calcium': 301,
+    'iron': 303
+}
+NUTRIENT_FIELDS = tuple(NUTRIENT_NUMBERS)
+
+# Foundation foods often report energy only as Atwater specific/general factors
+_ENERGY_FALLBACK_NUMBERS = (958, 957)
+
+# Bulk-download data_type values -> the dataType names the API returns
+DATA_TYPES = {
+    'foundation_food': 'Foundation',
+    'sr_legacy_food': 'SR Legacy',
+    'survey_fndds_food': 'Survey (FNDDS)'
+}
+
+_MIN_COVERAGE = 0.5  # share of query tokens a description must contain to count as a match
+
+
+def _nutrient_number(value) -> Optional[int]:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _amount(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _apply_nutrient(nutrients: Dict, number: int, amount: Optional[float]):
+    """Store one nutrient amount on a food record being imported"""
+    if amount is None:
+        return
+    for field, field_number in NUTRIENT_NUMBERS.items():
+        if number == field_number:
+            nutrients[field] = amount
+            return
+    if number in _ENERGY_FALLBACK_NUMBERS:
+        nutrients.setdefault(f'_energy_{number}', amount)
+
+
+def _finish_nutrients(nutrients: Dict) -> Dict:
+    if nutrients.get('calories') is None:
+        for number in _ENERGY_FALLBACK_NUMBERS:
+            if nutrients.get(f'_energy_{number}') is not None:
+                nutrients['calories'] = nutrients[f'_energy_{number}']
+                break
+    return {field: nutrients.get(field) for field in NUTRIENT_FIELDS}
+
+
+def _csv_opener(source: str) -> Callable[[str], Optional[TextIO]]:
+    """Return open(name) for the CSV files of a download (directory or .zip)"""
+    if zipfile.is_zipfile(source):
+        archive = zipfile.ZipFile(source)
+        members = {os.path.basename(name): name for name in archive.namelist()}
+
+        def open_member(name):
+            if name not in members:
+                return None
+            return io.TextIOWrapper(archive.open(members[name]), encoding='utf-8', newline='')
+        return open_member
+
+    paths = {}
+    for root, _, files in os.walk(source):
+        for name in files:
+            paths.setdefault(name, os.path.join(root, name))
+
+    def open_file(name):
+        return open(paths[name], encoding='utf-8', newline='') if name in paths else None
+    return open_file
+
+
+def _read_csv(open_member, name: str) -> Iterator[Dict]:
+    handle = open_member(name)
+    if handle is None:
+        return
+    with handle:
+        yield from csv.DictReader(handle)
+
+
+def iter_csv_foods(source: str) -> Iterator[Dict]:
+    """
+    Foods from a CSV download (food.csv, nutrient.csv, food_nutrient.csv, ...)
+
+    Only Foundation, SR Legacy and FNDDS foods are kept, so the full
+    all-types download can be imported as well.
+    """
+    open_member = _csv_opener(source)
+
+    # food_nutrient.csv references nutrient.csv ids, not the legacy numbers
+    numbers = {}
+    for row in _read_csv(open_member, 'nutrient.csv'):
+        number = _nutrient_number(row.get('nutrient_nbr'))
+        if number in NUTRIENT_NUMBERS.values() or number in _ENERGY_FALLBACK_NUMBERS:
+            numbers[row['id']] = number
+
+    categories = {row['id']: row.get('description', '') for row in _read_csv(open_member, 'food_category.csv')}
+    survey_categories = {
+        row['wweia_food_category']: row.get('wweia_food_category_description', '')
+        for row in _read_csv(open_member, 'wweia_food_category.csv')
+    }
+
+    foods = {}
+    for row in _read_csv(open_member, 'food.csv'):
+        data_type = DATA_TYPES.get(row.get('data_type'))
+        if data_type is None:
+            continue
+        category_id = row.get('food_category_id') or ''
+        category_names = survey_categories if data_type == 'Survey (FNDDS)' else categories
+        foods[row['fdc_id']] = {
+            'fdc_id': int(row['fdc_id']),
+            'description': row.get('description', ''),
+            'data_type': data_type,
+            'category': category_names.get(category_id, ''),
+            'nutrients': {}
+        }
+    if not foods:
+        raise ValueError(f"No Foundation/SR Legacy/FNDDS foods found in {source}")
+
+    for row in _read_csv(open_member, 'food_nutrient.csv'):
+        food = foods.get(row.get('fdc_id'))
+        number = numbers.get(row.get('nutrient_id'))
+        if food is not None and number is not None:
+            _apply_nutrient(food['nutrients'], number, _amount(row.get('amount')))
+
+    for food in foods.values():
+        food['nutrients'] = _finish_nutrients(food['nutrients'])
+        yield food
+
+
+def iter_json_foods(source: str) -> Iterator[Dict]:
+    """Foods from a JSON download ({"FoundationFoods": [...]}, {"SRLegacyFoods": [...]}, ...)"""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            names = [name for name in archive.namelist() if name.endswith('.json')]
+            documents = [json.loads(archive.read(name)) for name in names]
+    else:
+        with open(source, encoding='utf-8') as handle:
+            documents = [json.load(handle)]
+
+    for document in documents:
+        for items in document.values():
+            if not isinstance(items, list):
+                continue
+            for item in items:
+                data_type = item.get('dataType')
+                if data_type not in DATA_TYPES.values():
+                    continue
+                nutrients = {}
+                for entry in item.get('foodNutrients', []):
+                    number = _nutrient_number((entry.get('nutrient') or {}).get('number'))
+                    if number is not None:
+                        _apply_nutrient(nutrients, number, _amount(entry.get('amount')))
+                category = item.get('foodCategory') or item.get('wweiaFoodCategory') or {}
+                yield {
+                    'fdc_id': int(item['fdcId']),
+                    'description': item.get('description', ''),
+                    'data_type': data_type,
+                    'category': category.get('description') or category.get('wweiaFoodCategoryDescription', ''),
+                    'nutrients': _finish_nutrients(nutrients)
+                }
+
+
+def _is_json_source(source: str) -> bool:
+    if source.lower().endswith('.json'):
+        return True
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            return any(name.endswith('.json') for name in archive.namelist())
+    return False
+
+
+def import_fdc_dataset(sources: Iterable[str], db_path: str, table_path: Optional[str] = None) -> Dict:
+    """
+    Build the offline store from one or more FDC bulk downloads
+
+    The database is written next to `db_path` and swapped in with a rename,
+    so workers reading the previous file are not disturbed.
+
+    Args:
+        sources: CSV download directories/zips or JSON files/zips
+        db_path: SQLite file to create
+        table_path: Also compile the memory-mapped nutrient table here
+
+    Returns:
+        Import counts
+    """
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    building = f"{db_path}.building"
+    if os.path.exists(building):
+        os.remove(building)
+
+    started = time.perf_counter()
+    counts = {data_type: 0 for data_type in DATA_TYPES.values()}
+    conn = sqlite3.connect(building)
+    try:
+        conn.execute(f"""
+            CREATE TABLE foods (
+                fdc_id INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                data_type TEXT NOT NULL,
+                category TEXT,
+                token_count INTEGER NOT NULL,
+                {', '.join(f'{field} REAL' for field in NUTRIENT_FIELDS)}
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE food_tokens (
+                token TEXT NOT NULL,
+                fdc_id INTEGER NOT NULL,
+                PRIMARY KEY (token, fdc_id)
+            ) WITHOUT ROWID
+        """)
+
+        insert_food = (
+            f"INSERT OR REPLACE INTO foods (fdc_id, description, data_type, category, token_count, "
+            f"{', '.join(NUTRIENT_FIELDS)}) VALUES ({', '.join('?' * (5 + len(NUTRIENT_FIELDS)))})"
+        )
+        for source in sources:
+            foods = iter_json_foods(source) if _is_json_source(source) else iter_csv_foods(source)
+            for food in foods:
+                tokens = set(tokenize(food['description']))
+                conn.execute(insert_food, (
+                    food['fdc_id'], food['description'], food['data_type'], food['category'], len(tokens),
+                    *(food['nutrients'][field] for field in NUTRIENT_FIELDS)
+                ))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO food_tokens (token, fdc_id) VALUES (?, ?)",
+                    ((token, food['fdc_id']) for token in tokens)
+                )
+                counts[food['data_type']] += 1
+            logging.info(f"Imported FDC foods from {source}")
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+    os.replace(building, db_path)
+    result = {
+        'foods': sum(counts.values()),
+        'by_data_type': counts,
+        'path': db_path
+    }
+    if table_path:
+        from .nutrient_table import compile_nutrient_table
+        result['nutrient_table'] = compile_nutrient_table(db_path, table_path)
+    result['seconds'] = round(time.perf_counter() - started, 2)
+    return result
+
+
+class OfflineFoodIndex:
+    def __init__(self, path: str, table=None):
+        """
+        Read-only token search over the store built by import_fdc_dataset
+
+        The store is a local SQLite file opened read-only, so every worker
+        shares the OS page cache instead of loading the data into memory.
+        With a compiled nutrient table, exact names and FDC ids are answered
+        from the memory-mapped table and SQLite only serves token searches.
+
+        Args:
+            path: SQLite file written by import_fdc_dataset
+            table: Optional NutrientTable compiled from the same store
+        """
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self.searches = 0
+        self.matches = 0
+        self.name_index_hits = 0
+        self.search_seconds = 0.0
+
+    @property
+    def available(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Reopen after fork: SQLite handles must not cross process boundaries
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._pid = os.getpid()
+        return self._conn
+
+    def search(self, query: str, limit: int = 5) -> List[Dict]:
+        """
+        Foods whose descriptions best match the query
+
+        Candidates share at least half of the query's tokens and are ranked
+        with food_matching.score_candidate, like API search results.
+
+        Returns:
+            Up to `limit` results in the USDAService search result layout
+        """
+        started = time.perf_counter()
+        if self.table is not None:
+            rows = self.table.find_name(query)
+            if rows:
+                results = sorted(
+                    (self.table.record(row) for row in rows),
+                    key=lambda result: -DATA_TYPE_PREFERENCE.get(result['data_type'], 0)
+                )[:limit]
+                self._count(started, True, name_index=True)
+                return results
+
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        with self._lock:
+            rows = self._connection().execute(f"""
+                SELECT f.*, COUNT(*) AS hits
+                FROM food_tokens t JOIN foods f ON f.fdc_id = t.fdc_id
+                WHERE t.token IN ({', '.join('?' * len(tokens))})
+                GROUP BY t.fdc_id
+                ORDER BY hits DESC, f.token_count ASC
+                LIMIT 200
+            """, tokens).fetchall()
+
+        ranked = sorted(
+            (row for row in rows if row['hits'] / len(tokens) >= _MIN_COVERAGE),
+            key=lambda row: -score_candidate(
+                tokens, row['description'], row['data_type'],
+                sum(row[field] is not None for field in NUTRIENT_FIELDS) / len(NUTRIENT_FIELDS)
+            )
+        )[:limit]
+
+        results = [self._result(row) for row in ranked]
+        self._count(started, bool(results))
+        return results
+
+    def _count(self, started: float, matched: bool, name_index: bool = False):
+        with self._lock:
+            self.searches += 1
+            self.matches += matched
+            self.name_index_hits += name_index
+            self.search_seconds += time.perf_counter() - started
+
+    def best_match(self, query: str) -> Optional[Dict]:
+        results = self.search(query, limit=1)
+        return results[0] if results else None
+
+    def get(self, fdc_id: int) -> Optional[Dict]:
+        """Food by FDC id, in the USDAService get_food_details layout"""
+        if self.table is not None:
+            row = self.table.row_of(fdc_id)
+            result = self.table.record(row) if row is not None else None
+        else:
+            with self._lock:
+                row = self._connection().execute("SELECT * FROM foods WHERE fdc_id = ?", (int(fdc_id),)).fetchone()
+            result = self._result(row) if row is not None else None
+        if result is None:
+            return None
+        result['serving_size'] = 100
+        result['serving_unit'] = 'grams'
+        return result
+
+    def _result(self, row) -> Dict:
+        table_row = self.table.row_of(row['fdc_id']) if self.table is not None else None
+        if table_row is not None:
+            return self.table.record(table_row)
+        return {
+            'usda_id': row['fdc_id'],
+            'name': row['description'],
+            'brand': '',
+            'category': row['category'] or '',
+            'data_type': row['data_type'],
+            'nutrition': {field: row[field] or 0 for field in NUTRIENT_FIELDS},
+            'source': 'offline'
+        }
+
+    def stats(self) -> Dict:
+        return {
+            'path': self.path,
+            'available': self.available,
+            'searches': self.searches,
+            'matches': self.matches,
+            'name_index_hits': self.name_index_hits,
+            'nutrient_table': {'path': self.table.path, 'rows': len(self.table)} if self.table is not None else None,
+            'avg_search_ms': round(self.search_seconds / self.searches * 1000, 3) if self.searches else 0.0
+        }
+
+
+_index: Optional[OfflineFoodIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_offline_food_index() -> OfflineFoodIndex:
+    """Return the process-wide offline USDA index at USDA_OFFLINE_DB (plus USDA_NUTRIENT_TABLE if compiled)"""
+    global _index
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                from .nutrient_table import get_nutrient_table
+                _index = OfflineFoodIndex(
+                    os.getenv('USDA_OFFLINE_DB', os.path.join('data', 'usda_fdc.sqlite3')),
+                    table=get_nutrient_table()
+                )
+    return _index
+
+
+if __name__ == "__main__":
+    # python -m app.services.usda_offline FoodData_Central_foundation_food_csv.zip FoodData_Central_sr_legacy_food_csv.zip
+    parser = argparse.ArgumentParser(description='Import USDA FoodData Central bulk downloads for offline lookups')
+    parser.add_argument('sources', nargs='+', help='CSV download directories/zips or JSON files/zips')
+    parser.add_argument('--db', default=os.getenv('USDA_OFFLINE_DB', os.path.join('data', 'usda_fdc.sqlite3')))
+    parser.add_argument('--table', default=os.getenv('USDA_NUTRIENT_TABLE', os.path.join('data', 'usda_nutrients.bin')),
+                        help="Memory-mapped nutrient table to compile ('' to skip)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    print("Import result:", import_fdc_dataset(args.sources, args.db, args.table or None))
@@ -2,8 +2,37 @@
 import requests
 import os
 import logging
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+from .usda_cache import get_usda_cache
+from .negative_cache import get_usda_negative_cache
+from .rate_limiter import get_usda_rate_limiter
+from .food_matching import score_candidate, token_coverage, tokenize
+from .usda_offline import get_offline_food_index
+from .ingredient_resolver import get_ingredient_resolver
+
+# Process-wide pool for ingredient enrichment; its size is the global cap on
+# concurrent USDA lookups across all requests handled by this worker
+_enrichment_executor = None
+_enrichment_executor_pid = None
+_enrichment_executor_lock = threading.Lock()
+
+def get_enrichment_executor() -> ThreadPoolExecutor:
+    """Return the shared USDA enrichment thread pool (recreated after fork)"""
+    global _enrichment_executor, _enrichment_executor_pid
+    
+    if _enrichment_executor is None or _enrichment_executor_pid != os.getpid():
+        with _enrichment_executor_lock:
+            if _enrichment_executor is None or _enrichment_executor_pid != os.getpid():
+                _enrichment_executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('USDA_MAX_CONCURRENCY', 8)),
+                    thread_name_prefix='usda-enrich'
+                )
+                _enrichment_executor_pid = os.getpid()
+    return _enrichment_executor
 
 class USDAService:
     def __init__(self):
@@ -14,7 +43,19 @@ class USDAService:
             self.api_key = 'DEMO_KEY'  # Use demo key as fallback
         
         self.base_url = os.getenv('USDA_BASE_URL', 'https://api.nal.usda.gov/fdc/v1')
+        
+        # One keep-alive session shared by all enrichment threads; size its
+        # connection pool to match so concurrent lookups never reconnect
+        max_concurrency = int(os.getenv('USDA_MAX_CONCURRENCY', 8))
         self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(max_concurrency, 10))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.cache = get_usda_cache()
+        # Queries that recently returned no foods go straight to the fallback
+        self.negative_cache = get_usda_negative_cache()
+        # Surface forms ("nasi putih", "steamed rice") share one canonical name and cache key
+        self.resolver = get_ingredient_resolver()
         
         # Nutrient IDs we're interested in
         self.nutrient_ids = {
@@ -29,85 +70,111 @@ class USDAService:
             303: "Iron, Fe"             # Iron
         }
         
-        # Rate limiting
-        self.last_request_time = 0
-        self.min_request_interval = 0.1  # 100ms between requests
-        
-    def _rate_limit(self):
-        """Implement rate limiting"""
-        current_time = time.time()
-        elapsed = current_time - self.last_request_time
-        if elapsed < self.min_request_interval:
-            time.sleep(self.min_request_interval - elapsed)
-        self.last_request_time = time.time()
+        # Rate limiting: one token bucket shared by every USDA call in the process
+        self.rate_limiter = get_usda_rate_limiter()
+        
+        # USDA_BACKEND: api (network only), offline (imported FDC dataset only)
+        # or hybrid (offline first, API for names the dataset does not match)
+        self.backend = os.getenv('USDA_BACKEND', 'api').lower()
+        self.offline = None
+        if self.backend in ('offline', 'hybrid'):
+            index = get_offline_food_index()
+            if index.available:
+                self.offline = index
+            else:
+                logging.warning(f"USDA offline dataset {index.path} not found, using the API "
+                                f"(import it with python -m app.services.usda_offline)")
+        
+    def _rate_limit(self) -> float:
+        """Wait for a token from the shared limiter; returns seconds spent throttled"""
+        wait = self.rate_limiter.reserve()
+        if wait:
+            logging.info(f"USDA request throttled for {wait:.3f}s")
+            time.sleep(wait)
+        return wait
+    
+    def warm_up(self):
+        """Pre-open a keep-alive connection to the USDA API (no API key, no quota used)"""
+        self.session.head(self.base_url, timeout=5)
     
-    def search_food(self, query: str, page_size: int = 25) -> Optional[Dict]:
+    def search_food(self, query: str, page_size: int = 50) -> Optional[Dict]:
         """
         Search for food items in USDA database
         
         Args:
             query: Food name to search for
-            page_size: Number of results to return
+            page_size: Number of candidates fetched and ranked locally
             
         Returns:
             Dictionary containing search results
         """
+        canonical = self.resolver.resolve(query)
+        if canonical and canonical != query.strip().lower():
+            logging.info(f"Resolved ingredient '{query}' to '{canonical}'")
+        query = canonical or query
+        
+        if self.offline is not None:
+            result = self.offline.best_match(query)
+            if result is not None:
+                return result
+            if self.backend == 'offline':
+                logging.warning(f"No offline USDA match for query: {query}")
+                return self.get_fallback_nutrition_estimate(query, "General")
+        
+        cache_key = self.cache.search_key(query)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"USDA cache hit for query: '{query}'")
+            return cached
+        
+        if self.negative_cache.contains(query):
+            logging.info(f"USDA negative cache hit for query: '{query}', using fallback")
+            return self.get_fallback_nutrition_estimate(query, "General")
+        
         try:
+            # One request for a page of candidates, ranked locally (no query variants)
+            params = {
+                'api_key': self.api_key,
+                'query': query.strip().lower(),
+                'dataType': ['Foundation', 'SR Legacy', 'Survey (FNDDS)'],  # Include more data types
+                'pageSize': min(page_size, 200),  # USDA limits to 200
+                'pageNumber': 1,
+                'sortBy': 'relevance',
+                'brandOwner': ''  # Empty for generic foods
+            }
+            
+            url = f"{self.base_url}/foods/search"
+            logging.info(f"USDA search for '{query}' ({params['pageSize']} candidates)")
+            
             self._rate_limit()
+            response = self.session.get(url, params=params, timeout=10)
             
-            # Clean query string for better matching
-            cleaned_query = query.strip().lower()
+            logging.info(f"USDA API response status: {response.status_code}")
             
-            # Try multiple search variations
-            search_queries = [
-                cleaned_query,
-                cleaned_query.replace(' ', '+'),
-                cleaned_query.split()[0] if ' ' in cleaned_query else cleaned_query  # First word only
-            ]
+            if response.status_code == 403:
+                logging.error("USDA API returned 403 - Check API key")
+                return self.get_fallback_nutrition_estimate(query, "General")
+            elif response.status_code == 400:
+                logging.error(f"USDA API returned 400 - Bad request: {response.text}")
+                return self.get_fallback_nutrition_estimate(query, "General")
             
-            for search_query in search_queries:
-                logging.info(f"Trying USDA search with query: '{search_query}'")
-                
-                # Improved parameters for better USDA API results
-                params = {
-                    'api_key': self.api_key,
-                    'query': search_query,
-                    'dataType': ['Foundation', 'SR Legacy', 'Survey (FNDDS)'],  # Include more data types
-                    'pageSize': min(page_size, 50),  # USDA limits to 200
-                    'pageNumber': 1,
-                    'sortBy': 'relevance',
-                    'brandOwner': ''  # Empty for generic foods
-                }
-                
-                url = f"{self.base_url}/foods/search"
-                logging.info(f"USDA search URL: {url}")
-                logging.info(f"USDA search params: {params}")
-                
-                response = self.session.get(url, params=params, timeout=10)
-                
-                logging.info(f"USDA API response status: {response.status_code}")
-                
-                if response.status_code == 403:
-                    logging.error("USDA API returned 403 - Check API key")
-                    break  # Don't retry on auth error
-                elif response.status_code == 400:
-                    logging.error(f"USDA API returned 400 - Bad request: {response.text}")
-                    continue  # Try next query
-                    
-                response.raise_for_status()
-                
-                data = response.json()
-                
-                logging.info(f"USDA search for '{search_query}': Found {data.get('totalHits', 0)} results")
-                
-                if data.get('foods') and len(data['foods']) > 0:
-                    # Return the best match (first result)
-                    result = self._process_search_result(data['foods'][0])
-                    logging.info(f"USDA result for '{search_query}': {result.get('name')} (ID: {result.get('usda_id')})")
-                    return result
+            response.raise_for_status()
             
-            # If all queries failed, return fallback
-            logging.warning(f"No USDA foods found for any variation of query: {query}")
+            data = response.json()
+            
+            logging.info(f"USDA search for '{query}': Found {data.get('totalHits', 0)} results")
+            
+            best = self._best_candidate(query, data.get('foods') or [])
+            if best is not None:
+                result = self._process_search_result(best)
+                logging.info(f"USDA result for '{query}': {result.get('name')} (ID: {result.get('usda_id')})")
+                # Only real matches are cached; fallbacks after errors must be retried
+                self.cache.set(cache_key, result)
+                return result
+            
+            logging.warning(f"No USDA foods found for query: {query}")
+            # A definite miss (not an error): skip the request for a while
+            self.negative_cache.add(query)
             return self.get_fallback_nutrition_estimate(query, "General")
             
         except requests.exceptions.Timeout:
@@ -130,6 +197,16 @@ class USDAService:
         Returns:
             Dictionary containing detailed nutrition data
         """
+        if self.offline is not None:
+            result = self.offline.get(fdc_id)
+            if result is not None or self.backend == 'offline':
+                return result
+        
+        cache_key = self.cache.food_key(fdc_id)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
             self._rate_limit()
             
@@ -143,7 +220,9 @@ class USDAService:
             response.raise_for_status()
             
             data = response.json()
-            return self._process_food_details(data)
+            result = self._process_food_details(data)
+            self.cache.set(cache_key, result)
+            return result
             
         except requests.exceptions.RequestException as e:
             logging.error(f"USDA details request failed: {str(e)}")
@@ -152,6 +231,44 @@ class USDAService:
             logging.error(f"USDA get details failed: {str(e)}")
             return None
     
+    def _best_candidate(self, query: str, foods: List[Dict]) -> Optional[Dict]:
+        """
+        Pick the search result that best answers the query
+        
+        Candidates are scored on token overlap, data type (Foundation > SR
+        Legacy > FNDDS) and how many of the tracked nutrients they report.
+        The API's relevance order breaks ties, and is all that is left when
+        no description shares a token with the query.
+        """
+        if not foods:
+            return None
+        tokens = tokenize(query)
+        
+        def score(food):
+            reported = self._tracked_nutrient_ids(food.get('foodNutrients', []))
+            return score_candidate(
+                tokens, food.get('description', ''), food.get('dataType', ''),
+                len(reported) / len(self.nutrient_ids)
+            )
+        
+        if not any(token_coverage(tokens, food.get('description', '')) for food in foods):
+            return foods[0]
+        return max(foods, key=score)  # max keeps the first of equal scores
+    
+    def _nutrient_number(self, nutrient: Dict) -> Optional[int]:
+        """Legacy nutrient number of a foodNutrients entry"""
+        nutrient_id = nutrient.get('nutrientId')
+        if nutrient_id in self.nutrient_ids:
+            return nutrient_id
+        # Search results carry the new nutrient ids (1008 = Energy); the legacy one is nutrientNumber
+        try:
+            return int(float(nutrient.get('nutrientNumber') or nutrient.get('number')))
+        except (TypeError, ValueError):
+            return nutrient_id
+    
+    def _tracked_nutrient_ids(self, nutrients: List[Dict]) -> set:
+        return {self._nutrient_number(nutrient) for nutrient in nutrients} & set(self.nutrient_ids)
+    
     def _process_search_result(self, food_data: Dict) -> Dict:
         """Process search result and extract relevant information"""
         processed = {
@@ -203,8 +320,8 @@ class USDAService:
         }
         
         for nutrient in nutrients:
-            nutrient_id = nutrient.get('nutrientId')
-            value = nutrient.get('value', 0)
+            nutrient_id = self._nutrient_number(nutrient)
+            value = nutrient.get('value', nutrient.get('amount', 0))
             
             if nutrient_id == 208:  # Energy (calories)
                 nutrition['calories'] = value
@@ -227,6 +344,68 @@ class USDAService:
         
         return nutrition
     
+    def prefetch_food(self, food_name: str) -> Future:
+        """Start a search_food lookup on the enrichment pool without waiting for it"""
+        return get_enrichment_executor().submit(self.search_food, food_name)
+    
+    def search_foods_concurrently(self, food_names: List[str],
+                                  on_result: Optional[Callable[[str, Optional[Dict]], None]] = None,
+                                  pending: Optional[Dict[str, Future]] = None) -> List[Optional[Dict]]:
+        """
+        Search for several foods in parallel on the shared enrichment pool
+        
+        Duplicate names, and names resolving to the same canonical
+        ingredient, are looked up once. The stage takes roughly as long as
+        the slowest single lookup instead of the sum of all of them.
+        
+        Args:
+            food_names: List of food names to search for
+            on_result: Called as on_result(name, result) in the calling thread
+                for every name as soon as its lookup finishes
+            pending: Lookups already started with prefetch_food, by name
+            
+        Returns:
+            Search results in the same order as food_names
+        """
+        # Names resolving to the same canonical ingredient share one lookup
+        aliases = {}
+        for name in food_names:
+            aliases.setdefault(self.resolver.resolve(name) or name, []).append(name)
+        for canonical in aliases:
+            aliases[canonical] = list(dict.fromkeys(aliases[canonical]))
+        pending = pending or {}
+        started = {
+            canonical: next((pending[name] for name in names if name in pending), None)
+            for canonical, names in aliases.items()
+        }
+        results = {}
+        
+        def deliver(canonical, result):
+            for name in aliases[canonical]:
+                results[name] = result
+                if on_result:
+                    on_result(name, result)
+        
+        if len(aliases) == 1 and not any(started.values()):
+            canonical = next(iter(aliases))
+            deliver(canonical, self.search_food(canonical))
+        else:
+            executor = get_enrichment_executor()
+            futures = {
+                started[canonical] or executor.submit(self.search_food, canonical): canonical
+                for canonical in aliases
+            }
+            for future in as_completed(futures):
+                canonical = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.error(f"Concurrent USDA search failed for '{canonical}': {str(e)}")
+                    result = None
+                deliver(canonical, result)
+        
+        return [results[name] for name in food_names]
+    
     def search_multiple_foods(self, food_names: List[str]) -> Dict[str, Dict]:
         """
         Search for multiple foods at once
@@ -239,8 +418,7 @@ class USDAService:
         """
         results = {}
         
-        for food_name in food_names:
-            result = self.search_food(food_name)
+        for food_name, result in zip(food_names, self.search_foods_concurrently(food_names)):
             if result:
                 results[food_name] = result
             else: